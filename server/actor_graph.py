@@ -1,28 +1,227 @@
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
+from batch_converter import NUMERIC_ID_COLUMNS
+import metrics
+import threading
+import time
+import atexit
 import re
 import os
 import sys
 
-class ActorGraph:
-    def __init__(self, username, password):
-        load_dotenv()
-        self.driver = GraphDatabase.driver(os.getenv('NEO4J_HOST'), auth=(username, password))
+load_dotenv()
+NEO4J_HOST = os.getenv('NEO4J_HOST')
+NEO4J_POOL_SIZE = int(os.getenv('NEO4J_POOL_SIZE', 50))
+NEO4J_POOL_ACQUISITION_TIMEOUT = float(os.getenv('NEO4J_POOL_ACQUISITION_TIMEOUT', 60))
+NEO4J_POOL_MAX_LIFETIME = int(os.getenv('NEO4J_POOL_MAX_LIFETIME', 3600))
+NEO4J_MAX_RETRY_TIME = float(os.getenv('NEO4J_MAX_RETRY_TIME', 30))
+NEO4J_WRITE_CHUNK_SIZE = int(os.getenv('NEO4J_WRITE_CHUNK_SIZE', 10000))
+NEO4J_LOAD_BATCH_SIZE = int(os.getenv('NEO4J_LOAD_BATCH_SIZE', 10000))
+NUMERIC_IDS = os.getenv('NUMERIC_IDS', '').lower() in ('1', 'true', 'yes')
+
+# one driver (and so one connection pool) per process, shared by every ActorGraph
+_drivers = {}
+_drivers_lock = threading.Lock()
+
+
+def get_driver(username, password):
+    key = (NEO4J_HOST, username, os.getpid())
+    driver = _drivers.get(key)
+    if driver is not None:
+        return driver
+    with _drivers_lock:
+        if key not in _drivers:
+            # a driver inherited from a parent process (e.g. gunicorn --preload) shares its sockets,
+            # so it is dropped rather than closed and each worker builds its own pool
+            for stale_key in [k for k in _drivers if k[2] != os.getpid()]:
+                del _drivers[stale_key]
+            _drivers[key] = GraphDatabase.driver(
+                NEO4J_HOST, auth=(username, password),
+                max_connection_pool_size=NEO4J_POOL_SIZE,
+                connection_acquisition_timeout=NEO4J_POOL_ACQUISITION_TIMEOUT,
+                max_connection_lifetime=NEO4J_POOL_MAX_LIFETIME,
+                max_transaction_retry_time=NEO4J_MAX_RETRY_TIME)
+        return _drivers[key]
+
+
+def close_drivers():
+    with _drivers_lock:
+        for key in [k for k in _drivers if k[2] == os.getpid()]:
+            _drivers.pop(key).close()
+
+
+atexit.register(close_drivers)
+
+
+# the load and drop scripts touch this file when they finish so serving processes on the same host
+# can tell cached graph data is stale without asking the database
+GRAPH_VERSION_FILE = os.getenv('GRAPH_VERSION_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.graph_version'))
+
+
+def graph_version():
+    try:
+        return os.stat(GRAPH_VERSION_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def mark_graph_changed():
+    with open(GRAPH_VERSION_FILE, 'w') as f:
+        f.write(f'{time.time()}\n')
+
+
+# the variable length bound of shortestPath cannot be a parameter, so requested depths are rounded up to
+# one of a few fixed bounds and the exact depth is applied as a parameter; every actor pair and depth then
+# reuses one of these query texts and hits the plan cache
+CONNECTION_DEPTH_BOUNDS = (5, 10, 20, 30, 50)
+
+
+def connection_depth_bound(max_search_depth):
+    for bound in CONNECTION_DEPTH_BOUNDS:
+        if max_search_depth <= bound:
+            return bound
+    return CONNECTION_DEPTH_BOUNDS[-1]
+
+
+def _connection_query(depth_bound, id_key='name_id', all_paths=False):
+    # per-actor totals (materialized by compute_actor_stats) and each episode's parent series are
+    # gathered in the same round trip as the path so the request cost does not grow with path length;
+    # all_paths returns every shortest path, up to $limit of them
+    return f"""MATCH (a:Actor {{{id_key}: $actor_id_1}})
+               MATCH (b:Actor {{{id_key}: $actor_id_2}})
+               MATCH path = {'allShortestPaths' if all_paths else 'shortestPath'}((a)-[r:ACTED_IN*0..{depth_bound}]-(b))
+               WITH path
+               WHERE LENGTH(path) <= $max_search_depth
+               RETURN path,
+                      [x IN RELATIONSHIPS(path) | x.roles] AS roles,
+                      [x IN NODES(path) | LABELS(x)] AS node_type,
+                      [x IN NODES(path) | CASE WHEN x:Actor THEN {{
+                          movie_count: x.movie_count,
+                          episode_count: x.episode_count,
+                          series_count: x.series_count
+                      }} END] AS actor_totals,
+                      [x IN NODES(path) | CASE WHEN x:Episode THEN
+                          HEAD([(x)-[:EPISODE_OF]->(s:Series) | {{title: s.title, imdb_id: s.title_id, poster_path: s.poster_path, image_missed_at: s.image_missed_at}}])
+                      END] AS episode_series
+               {'LIMIT $limit' if all_paths else ''}
+            """
+
+
+CONNECTION_QUERIES = {bound: _connection_query(bound) for bound in CONNECTION_DEPTH_BOUNDS}
+NUMERIC_CONNECTION_QUERIES = {bound: _connection_query(bound, 'name_num') for bound in CONNECTION_DEPTH_BOUNDS}
+ALL_CONNECTIONS_QUERIES = {bound: _connection_query(bound, all_paths=True) for bound in CONNECTION_DEPTH_BOUNDS}
+NUMERIC_ALL_CONNECTIONS_QUERIES = {bound: _connection_query(bound, 'name_num', all_paths=True) for bound in CONNECTION_DEPTH_BOUNDS}
+
+# batch file column holding the digits of each imdb id column
+ID_NUMBER_COLUMNS = {column: numeric for numeric, column in NUMERIC_ID_COLUMNS.items()}
+
+ACTOR_STATS = """SET a.movie_count = SIZE(apoc.coll.toSet([(a)-[:ACTED_IN]->(m:Movie) | m])),
+                     a.episode_count = SIZE(apoc.coll.toSet([(a)-[:ACTED_IN]->(e:Episode) | e])),
+                     a.series_count = SIZE(apoc.coll.toSet([(a)-[:ACTED_IN]->(:Episode)-[:EPISODE_OF]->(s:Series) | s])),
+                     a.role_count = SIZE((a)-[:ACTED_IN]->())"""
+
+
+def _profile_db_hits(profile):
+    if not profile:
+        return 0
+    return profile.get('dbHits', 0) + sum(_profile_db_hits(child) for child in profile.get('children', []))
+
+
+class InstrumentedSession:
+    # a driver session that counts its queries into the current request's metrics and times how long it
+    # is open as the 'neo4j' stage, unless it is opened inside another stage that already covers it; when
+    # the request is profiled its queries run with PROFILE and their db hits are added up once the session
+    # closes
+    def __init__(self, session):
+        self.session = session
+        self.__profiled = []
+        self.__stage = None
 
     def __enter__(self):
+        self.__stage = metrics.stage('neo4j')
+        self.__stage.__enter__()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.driver.close()
+        try:
+            if self.__profiled:
+                metrics.count('neo4j_db_hits', sum(_profile_db_hits(result.consume().profile) for result in self.__profiled))
+        finally:
+            self.session.close()
+            if self.__stage is not None:
+                self.__stage.__exit__(None, None, None)
+
+    def run(self, query, parameters=None, **kwargs):
+        metrics.count('neo4j_queries')
+        if metrics.profiling():
+            result = self.session.run('PROFILE ' + query, parameters, **kwargs)
+            self.__profiled.append(result)
+            return result
+        return self.session.run(query, parameters, **kwargs)
+
+    def write_transaction(self, func, *args, **kwargs):
+        metrics.count('neo4j_queries')
+        return self.session.write_transaction(func, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
 
-    def __del__(self):
-        self.driver.close()
+class InstrumentedDriver:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def session(self, **config):
+        return InstrumentedSession(self.driver.session(**config))
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class ActorGraph:
+    def __init__(self, username, password, write_chunk_size=None, numeric_ids=None):
+        self.driver = InstrumentedDriver(get_driver(username, password))
+        self.write_chunk_size = write_chunk_size or NEO4J_WRITE_CHUNK_SIZE
+        # with numeric ids every node also stores the digits of its imdb id (name_num / title_num) and is
+        # matched on that integer, imdb id strings are still what goes in and out of every method; the
+        # batch files have to be converted with BatchConverter(numeric_ids=True) to load such a graph
+        self.numeric_ids = NUMERIC_IDS if numeric_ids is None else numeric_ids
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # the driver is shared by the whole process and closed by close_drivers on exit
+        pass
 
     def __required_property_is_null(self, prop):
         if prop is None or prop == '' or prop == '\\N':
             return True
         return False
 
+    def __id_key(self, id_column):
+        # the property (or batch file column) a node is matched on for an imdb id column
+        return ID_NUMBER_COLUMNS[id_column] if self.numeric_ids else id_column
+
+    def __id_number(self, imdb_id):
+        # the digits of an imdb id, stored and matched on with numeric ids
+        if not self.numeric_ids:
+            return None
+        try:
+            return int(imdb_id[2:])
+        except (TypeError, ValueError):
+            return None
+
+    def __id_value(self, imdb_id):
+        # an imdb id translated to what nodes are matched on
+        return self.__id_number(imdb_id) if self.numeric_ids else imdb_id
+
+    def __line_id(self, id_column):
+        # LOAD CSV expression for the id a node is matched on, batch file values are strings
+        if self.numeric_ids:
+            return f'toInteger(line.{ID_NUMBER_COLUMNS[id_column]})'
+        return f'line.{id_column}'
+
     def __convert_optional_property(self, prop, number=False):
         if prop == '\\N':
             return None
@@ -30,29 +229,41 @@ class ActorGraph:
             return int(prop)
         return prop
 
-    def __get_series_of_episode(self, session, episode_id):
-        query = """MATCH (e:Episode {title_id: $episode_id})-[:EPISODE_OF]->(s:Series)
-                   RETURN s.title AS title, s.title_id AS imdb_id
-                   LIMIT 1
-                """
-        result = session.run(query, {'episode_id': episode_id})
-        return result.single().data()
-
-    def __get_appearance_totals_of_actor(self, session, actor_id):
-        query = """MATCH (a:Actor {name_id: $actor_id})
-                   OPTIONAL MATCH (a)-[:ACTED_IN]->(m:Movie)
-                   OPTIONAL MATCH (a)-[:ACTED_IN]->(e:Episode)
-                   OPTIONAL MATCH (e)-[:EPISODE_OF]->(s:Series)
-                   WITH COUNT(DISTINCT m) AS movie_count, 
-                        COUNT(DISTINCT e) AS episode_count,
-                        COUNT(DISTINCT s) AS series_count
-                   WHERE (movie_count + episode_count) > 0
-                   RETURN movie_count, 
-                          episode_count,
-                          series_count
-                """
-        result = session.run(query, {'actor_id': actor_id})
-        return result.single().data()
+    def __build_connection(self, result_data):
+        path = result_data['path']
+        roles = result_data['roles']
+        node_types = result_data['node_type']
+        actor_totals = result_data['actor_totals']
+        episode_series = result_data['episode_series']
+        return_data = []
+        for p in path:
+            if p == 'ACTED_IN':
+                return_data.append({'role': roles.pop(0)})
+                continue
+            types = node_types.pop(0)
+            totals = actor_totals.pop(0)
+            series_details = episode_series.pop(0)
+            if 'name_id' in p:
+                a = p.copy()
+                a.update(totals)
+                return_data.append({'actor': a})
+            elif 'title_id' in p:
+                if 'Movie' in types:
+                    return_data.append({'movie': p})
+                elif 'Episode' in types:
+                    e = {
+                        'episode_num': p['episode_num'] if 'episode_num' in p else None,
+                        'season_num': p['season_num'] if 'season_num' in p else None,
+                        'episode_title': p['title'],
+                        'episode_id': p['title_id'],
+                        'year': p['year'] if 'year' in p else None,
+                        'parent_series': series_details['title'] if series_details else None,
+                        'parent_series_id': series_details['imdb_id'] if series_details else None,
+                        'parent_series_poster_path': series_details['poster_path'] if series_details else None,
+                        'parent_series_image_missed_at': series_details['image_missed_at'] if series_details else None
+                    }
+                    return_data.append({'episode': e})
+        return return_data
 
     def drop_all_nodes(self):
         with self.driver.session() as session:
@@ -74,8 +285,17 @@ class ActorGraph:
             {'label': 'Production', 'prop': 'title', 'index_name': 'production_title'},
             {'label': 'Movie', 'prop': 'title', 'index_name': 'movie_title'},
             {'label': 'Episode', 'prop': 'title', 'index_name': 'episode_title'},
-            {'label': 'Series', 'prop': 'title', 'index_name': 'series_title'}
+            {'label': 'Series', 'prop': 'title', 'index_name': 'series_title'},
+            {'label': 'Actor', 'prop': 'rand_idx', 'index_name': 'actor_rand_idx'}
         ]
+        if self.numeric_ids:
+            constraints += [
+                {'label': 'Actor', 'prop': 'name_num', 'constraint_name': 'actor_name_num'},
+                {'label': 'Production', 'prop': 'title_num', 'constraint_name': 'production_title_num'},
+                {'label': 'Movie', 'prop': 'title_num', 'constraint_name': 'movie_title_num'},
+                {'label': 'Episode', 'prop': 'title_num', 'constraint_name': 'episode_title_num'},
+                {'label': 'Series', 'prop': 'title_num', 'constraint_name': 'series_title_num'}
+            ]
         with self.driver.session() as session:
             for params in constraints:
                 constraint_query = f"CREATE CONSTRAINT {params['constraint_name']} ON (l:{params['label']}) ASSERT l.{params['prop']} IS UNIQUE"
@@ -90,21 +310,38 @@ class ActorGraph:
             session.run(query)
 
     def delete_orphans(self):
-        query = 'MATCH (n) WHERE NOT (n)--() DELETE n'
+        query = 'MATCH (n) WHERE NOT (n)--() AND NOT n:GraphMeta DELETE n'
         with self.driver.session() as session:
             session.run(query)
 
-    def add_actors_from_batch_file(self, filename):
+    def __load_batch_file(self, filename, statement, parallel=False):
+        # streams a batch file through apoc.periodic.iterate, committing every NEO4J_LOAD_BATCH_SIZE rows, and
+        # returns the row count; batches only run in parallel for node files, whose rows never touch the same
+        # node, as relationship batches sharing an actor or series would deadlock on its lock
         if not sys.platform == 'linux':
             filename = os.path.abspath(filename)
-        query = f"""
-                USING PERIODIC COMMIT 100000
-                LOAD CSV WITH HEADERS FROM 'file:///{filename}' as line FIELDTERMINATOR '\t'
-                CREATE (:Actor:Person {{name_id: toString(line.name_id), name: toString(line.name),
-                        birth_year: toInteger(line.birth_year), death_year: toInteger(line.death_year)}})
+        query = """CALL apoc.periodic.iterate($source, $statement,
+                                              {batchSize: $batch_size, parallel: $parallel, params: {url: $url}})
+                   YIELD total, failedOperations, errorMessages
+                   RETURN total, failedOperations, errorMessages
                 """
+        params = {'source': "LOAD CSV WITH HEADERS FROM $url AS line FIELDTERMINATOR '\\t' RETURN line",
+                  'statement': statement,
+                  'batch_size': NEO4J_LOAD_BATCH_SIZE,
+                  'parallel': parallel,
+                  'url': f'file:///{filename}'}
         with self.driver.session() as session:
-            session.run(query)
+            result = session.run(query, params).single()
+        if result['failedOperations']:
+            raise RuntimeError(f"{result['failedOperations']} rows of {filename} failed to load: {result['errorMessages']}")
+        return result['total']
+
+    def add_actors_from_batch_file(self, filename):
+        statement = """CREATE (:Actor:Person {name_id: toString(line.name_id), name: toString(line.name),
+                        birth_year: toInteger(line.birth_year), death_year: toInteger(line.death_year),
+                        name_num: toInteger(line.name_num)})
+                    """
+        return self.__load_batch_file(filename, statement, parallel=True)
 
     def add_actor(self, name_id, name, birth_year, death_year):
         if self.__required_property_is_null(name_id) or self.__required_property_is_null(name):
@@ -114,22 +351,17 @@ class ActorGraph:
 
         with self.driver.session() as session:
             query = """MERGE (a:Actor:Person{name_id: $name_id})
-                       ON CREATE SET a.name = $name, a.birth_year = $birth_year, a.death_year = $death_year
+                       ON CREATE SET a.name = $name, a.birth_year = $birth_year, a.death_year = $death_year, a.name_num = $name_num
                        ON MATCH SET a.death_year = $death_year
                     """
-            session.run(query, {'name_id': name_id, 'name': name, 'birth_year': birth_year, 'death_year': death_year})
+            session.run(query, {'name_id': name_id, 'name': name, 'birth_year': birth_year, 'death_year': death_year,
+                                'name_num': self.__id_number(name_id)})
 
     def add_movies_from_batch_file(self, filename):
-        if not sys.platform == 'linux':
-            filename = os.path.abspath(filename)
-        query = f"""
-                USING PERIODIC COMMIT 100000
-                LOAD CSV WITH HEADERS FROM 'file:///{filename}' as line FIELDTERMINATOR '\t'
-                CREATE (:Movie:Production {{title_id: toString(line.title_id), title: toString(line.title),
-                        year: toInteger(line.year)}})
-                """
-        with self.driver.session() as session:
-            session.run(query)
+        statement = """CREATE (:Movie:Production {title_id: toString(line.title_id), title: toString(line.title),
+                        year: toInteger(line.year), title_num: toInteger(line.title_num)})
+                    """
+        return self.__load_batch_file(filename, statement, parallel=True)
 
     def add_movie(self, title_id, title, year):
         if self.__required_property_is_null(title_id) or self.__required_property_is_null(title):
@@ -138,21 +370,16 @@ class ActorGraph:
 
         with self.driver.session() as session:
             query = """MERGE (m:Movie:Production{title_id: $title_id})
-                       ON CREATE SET m.title = $title, m.year = $year
+                       ON CREATE SET m.title = $title, m.year = $year, m.title_num = $title_num
                     """
-            session.run(query, {'title_id': title_id, 'title': title, 'year': year})
+            session.run(query, {'title_id': title_id, 'title': title, 'year': year, 'title_num': self.__id_number(title_id)})
 
     def add_series_from_batch_file(self, filename):
-        if not sys.platform == 'linux':
-            filename = os.path.abspath(filename)
-        query = f"""
-                USING PERIODIC COMMIT 100000
-                LOAD CSV WITH HEADERS FROM 'file:///{filename}' as line FIELDTERMINATOR '\t'
-                CREATE (:Series {{title_id: toString(line.title_id), title: toString(line.title),
-                        start_year: toInteger(line.start_year), end_year: toInteger(line.end_year)}})
-                """
-        with self.driver.session() as session:
-            session.run(query)
+        statement = """CREATE (:Series {title_id: toString(line.title_id), title: toString(line.title),
+                        start_year: toInteger(line.start_year), end_year: toInteger(line.end_year),
+                        title_num: toInteger(line.title_num)})
+                    """
+        return self.__load_batch_file(filename, statement, parallel=True)
 
     def add_series(self, title_id, title, start_year, end_year):
         if self.__required_property_is_null(title_id) or self.__required_property_is_null(title):
@@ -162,21 +389,16 @@ class ActorGraph:
 
         with self.driver.session() as session:
             query = """MERGE (s:Series{title_id: $title_id})
-                       ON CREATE SET s.title = $title, s.start_year = $start_year, s.end_year = $end_year
+                       ON CREATE SET s.title = $title, s.start_year = $start_year, s.end_year = $end_year, s.title_num = $title_num
                     """
-            session.run(query, {'title_id': title_id, 'title': title, 'start_year': start_year, 'end_year': end_year})
+            session.run(query, {'title_id': title_id, 'title': title, 'start_year': start_year, 'end_year': end_year,
+                                'title_num': self.__id_number(title_id)})
 
     def add_episodes_from_batch_file(self, filename):
-        if not sys.platform == 'linux':
-            filename = os.path.abspath(filename)
-        query = f"""
-                USING PERIODIC COMMIT 100000
-                LOAD CSV WITH HEADERS FROM 'file:///{filename}' as line FIELDTERMINATOR '\t'
-                CREATE (:Episode:Production {{title_id: toString(line.title_id), title: toString(line.title),
-                        year: toInteger(line.year)}})
-                """
-        with self.driver.session() as session:
-            session.run(query)
+        statement = """CREATE (:Episode:Production {title_id: toString(line.title_id), title: toString(line.title),
+                        year: toInteger(line.year), title_num: toInteger(line.title_num)})
+                    """
+        return self.__load_batch_file(filename, statement, parallel=True)
 
     def add_episode(self, title_id, title, year):
         if self.__required_property_is_null(title_id) or self.__required_property_is_null(title):
@@ -185,22 +407,16 @@ class ActorGraph:
 
         with self.driver.session() as session:
             query = """MERGE(e:Episode:Production{title_id: $title_id})
-                       ON CREATE SET e.title = $title, e.year = $year
+                       ON CREATE SET e.title = $title, e.year = $year, e.title_num = $title_num
                     """
-            session.run(query, {'title_id': title_id, 'title': title, 'year': year})
+            session.run(query, {'title_id': title_id, 'title': title, 'year': year, 'title_num': self.__id_number(title_id)})
 
     def add_actor_relations_from_batch_file(self, filename):
-        if not sys.platform == 'linux':
-            filename = os.path.abspath(filename)
-        query = f"""
-                USING PERIODIC COMMIT 100000
-                LOAD CSV WITH HEADERS FROM 'file:///{filename}' as line FIELDTERMINATOR '\t'
-                MATCH (a:Actor{{name_id: line.name_id}})
-                MATCH (p:Production{{title_id: line.title_id}})
-                CREATE (a)-[r:ACTED_IN{{roles: toString(line.roles)}}]->(p)
-                """
-        with self.driver.session() as session:
-            session.run(query)
+        statement = f"""MATCH (a:Actor {{{self.__id_key('name_id')}: {self.__line_id('name_id')}}})
+                MATCH (p:Production {{{self.__id_key('title_id')}: {self.__line_id('title_id')}}})
+                CREATE (a)-[r:ACTED_IN {{roles: toString(line.roles)}}]->(p)
+                    """
+        return self.__load_batch_file(filename, statement, parallel=False)
 
     def add_role(self, title_id, actor_id, roles):
         if self.__required_property_is_null(title_id) or self.__required_property_is_null(actor_id):
@@ -210,26 +426,32 @@ class ActorGraph:
             roles = ', '.join([r.strip('"') for r in re.split(r',(?=")', roles.strip('[]'))])
 
         with self.driver.session() as session:
-            query = """MATCH (a:Actor{name_id: $actor_id})
-                       MATCH (p:Production{title_id: $title_id})
+            # a new role also bumps the actor's materialized counts, the series count only when it
+            # is the actor's first episode of that series
+            query = f"""MATCH (a:Actor {{{self.__id_key('name_id')}: $actor_id}})
+                       MATCH (p:Production {{{self.__id_key('title_id')}: $title_id}})
+                       OPTIONAL MATCH (a)-[existing:ACTED_IN]->(p)
+                       WITH a, p, COUNT(existing) = 0 AS is_new
                        MERGE (a)-[r:ACTED_IN]->(p)
                        SET r.roles = $roles
+                       WITH a, p, is_new
+                       WHERE is_new
+                       OPTIONAL MATCH (p)-[:EPISODE_OF]->(s:Series)
+                       WITH a, p, s IS NOT NULL AND SIZE([(a)-[:ACTED_IN]->(:Episode)-[:EPISODE_OF]->(s) | 1]) = 1 AS new_series
+                       SET a.role_count = COALESCE(a.role_count, 0) + 1,
+                           a.movie_count = COALESCE(a.movie_count, 0) + CASE WHEN p:Movie THEN 1 ELSE 0 END,
+                           a.episode_count = COALESCE(a.episode_count, 0) + CASE WHEN p:Episode THEN 1 ELSE 0 END,
+                           a.series_count = COALESCE(a.series_count, 0) + CASE WHEN new_series THEN 1 ELSE 0 END
                     """
-            session.run(query, {'title_id': title_id, 'actor_id': actor_id, 'roles': roles})
+            session.run(query, {'title_id': self.__id_value(title_id), 'actor_id': self.__id_value(actor_id), 'roles': roles})
 
     def add_episode_relations_from_batch_file(self, filename):
-        if not sys.platform == 'linux':
-            filename = os.path.abspath(filename)
-        query = f"""
-                USING PERIODIC COMMIT 100000
-                LOAD CSV WITH HEADERS FROM 'file:///{filename}' as line FIELDTERMINATOR '\t'
-                MATCH (e:Episode{{title_id: line.episode_id}})
-                MATCH (s:Series{{title_id: line.series_id}})
+        statement = f"""MATCH (e:Episode {{{self.__id_key('title_id')}: {self.__line_id('episode_id')}}})
+                MATCH (s:Series {{{self.__id_key('title_id')}: {self.__line_id('series_id')}}})
                 CREATE (e)-[:EPISODE_OF]->(s)
                 SET e.episode_num = toInteger(line.episode_num), e.season_num = toInteger(line.season_num)
-                """
-        with self.driver.session() as session:
-            session.run(query)
+                    """
+        return self.__load_batch_file(filename, statement, parallel=False)
 
     def connect_episode(self, episode_id, series_id, season_num, episode_num):
         if self.__required_property_is_null(episode_id) or self.__required_property_is_null(series_id):
@@ -238,103 +460,282 @@ class ActorGraph:
         episode_num = self.__convert_optional_property(episode_num, number=True)
 
         with self.driver.session() as session:
-            query = """MATCH (e:Episode{title_id: $episode_id})
-                       MATCH (s:Series{title_id: $series_id})
+            # linking an episode to its series counts the series for actors with no other episode of it
+            query = f"""MATCH (e:Episode {{{self.__id_key('title_id')}: $episode_id}})
+                       MATCH (s:Series {{{self.__id_key('title_id')}: $series_id}})
                        SET e.season_num = $season_num, e.episode_num = $episode_num
+                       WITH e, s, NOT EXISTS((e)-[:EPISODE_OF]->(s)) AS is_new
                        MERGE (e)-[:EPISODE_OF]->(s)
+                       WITH e, s, is_new
+                       WHERE is_new
+                       MATCH (a:Actor)-[:ACTED_IN]->(e)
+                       WITH DISTINCT a, s
+                       WHERE SIZE([(a)-[:ACTED_IN]->(:Episode)-[:EPISODE_OF]->(s) | 1]) = 1
+                       SET a.series_count = COALESCE(a.series_count, 0) + 1
                     """
-            session.run(query, {'episode_id': episode_id, 'series_id': series_id, 'season_num': season_num, 'episode_num': episode_num})
+            session.run(query, {'episode_id': self.__id_value(episode_id), 'series_id': self.__id_value(series_id),
+                                'season_num': season_num, 'episode_num': episode_num})
+
+    # list variants of the add_* methods for programmatic and incremental loads; rows are dicts using the
+    # batch file columns (imdb '\\N' nulls are accepted too) and are written chunk_size rows at a time, each
+    # chunk in one UNWIND transaction that the driver retries on transient errors such as deadlocks or a
+    # leader switch; unlike the single row methods an existing node gets all of its properties updated
+
+    def __clean_rows(self, rows, required, optional=()):
+        for row in rows:
+            if any(self.__required_property_is_null(row.get(prop)) for prop in required):
+                continue
+            row = dict(row)
+            for prop in optional:
+                if row.get(prop) in ('', '\\N'):
+                    row[prop] = None
+            if self.numeric_ids:
+                for column in required:
+                    if column in ID_NUMBER_COLUMNS:
+                        row[ID_NUMBER_COLUMNS[column]] = self.__id_number(row[column])
+            yield row
+
+    @staticmethod
+    def __write_chunk(tx, query, chunk):
+        tx.run(query, {'rows': chunk}).consume()
+
+    def __write_rows(self, query, rows, chunk_size=None):
+        chunk_size = chunk_size or self.write_chunk_size
+        total = 0
+        chunk = []
+        with self.driver.session() as session:
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    session.write_transaction(self.__write_chunk, query, chunk)
+                    total += len(chunk)
+                    chunk = []
+            if chunk:
+                session.write_transaction(self.__write_chunk, query, chunk)
+                total += len(chunk)
+        return total
+
+    def add_actors(self, rows, chunk_size=None):
+        query = """UNWIND $rows AS row
+                   MERGE (a:Actor:Person {name_id: row.name_id})
+                   SET a.name = row.name, a.birth_year = toInteger(row.birth_year), a.death_year = toInteger(row.death_year),
+                       a.name_num = toInteger(row.name_num)
+                """
+        return self.__write_rows(query, self.__clean_rows(rows, ['name_id', 'name'], ['birth_year', 'death_year']), chunk_size)
+
+    def add_movies(self, rows, chunk_size=None):
+        # merged on Production so a title that changed between movie and episode is relabelled in place
+        query = """UNWIND $rows AS row
+                   MERGE (m:Production {title_id: row.title_id})
+                   SET m:Movie, m.title = row.title, m.year = toInteger(row.year), m.title_num = toInteger(row.title_num)
+                   REMOVE m:Episode
+                """
+        return self.__write_rows(query, self.__clean_rows(rows, ['title_id', 'title'], ['year']), chunk_size)
+
+    def add_series_list(self, rows, chunk_size=None):
+        query = """UNWIND $rows AS row
+                   MERGE (s:Series {title_id: row.title_id})
+                   SET s.title = row.title, s.start_year = toInteger(row.start_year), s.end_year = toInteger(row.end_year),
+                       s.title_num = toInteger(row.title_num)
+                """
+        return self.__write_rows(query, self.__clean_rows(rows, ['title_id', 'title'], ['start_year', 'end_year']), chunk_size)
+
+    def add_episodes(self, rows, chunk_size=None):
+        query = """UNWIND $rows AS row
+                   MERGE (e:Production {title_id: row.title_id})
+                   SET e:Episode, e.title = row.title, e.year = toInteger(row.year), e.title_num = toInteger(row.title_num)
+                   REMOVE e:Movie
+                """
+        return self.__write_rows(query, self.__clean_rows(rows, ['title_id', 'title'], ['year']), chunk_size)
+
+    def add_roles(self, rows, chunk_size=None):
+        # actor statistics are not adjusted here, call refresh_actor_stats for the affected actors
+        query = f"""UNWIND $rows AS row
+                   MATCH (a:Actor {{{self.__id_key('name_id')}: row.{self.__id_key('name_id')}}})
+                   MATCH (p:Production {{{self.__id_key('title_id')}: row.{self.__id_key('title_id')}}})
+                   MERGE (a)-[r:ACTED_IN]->(p)
+                   SET r.roles = row.roles
+                """
+        return self.__write_rows(query, self.__clean_rows(rows, ['title_id', 'name_id'], ['roles']), chunk_size)
+
+    def connect_episodes(self, rows, chunk_size=None):
+        query = f"""UNWIND $rows AS row
+                   MATCH (e:Episode {{{self.__id_key('title_id')}: row.{self.__id_key('episode_id')}}})
+                   MATCH (s:Series {{{self.__id_key('title_id')}: row.{self.__id_key('series_id')}}})
+                   SET e.season_num = toInteger(row.season_num), e.episode_num = toInteger(row.episode_num)
+                   WITH e, s
+                   OPTIONAL MATCH (e)-[old:EPISODE_OF]->(other:Series)
+                   WHERE other <> s
+                   DELETE old
+                   MERGE (e)-[:EPISODE_OF]->(s)
+                """
+        return self.__write_rows(query, self.__clean_rows(rows, ['episode_id', 'series_id'], ['season_num', 'episode_num']), chunk_size)
+
+    def delete_actors(self, name_ids, chunk_size=None):
+        query = """UNWIND $rows AS name_id
+                   MATCH (a:Actor {name_id: name_id})
+                   DETACH DELETE a
+                """
+        return self.__write_rows(query, name_ids, chunk_size)
+
+    def delete_productions(self, title_ids, chunk_size=None):
+        query = """UNWIND $rows AS title_id
+                   MATCH (p:Production {title_id: title_id})
+                   DETACH DELETE p
+                """
+        return self.__write_rows(query, title_ids, chunk_size)
+
+    def delete_series(self, title_ids, chunk_size=None):
+        query = """UNWIND $rows AS title_id
+                   MATCH (s:Series {title_id: title_id})
+                   DETACH DELETE s
+                """
+        return self.__write_rows(query, title_ids, chunk_size)
+
+    def delete_roles(self, rows, chunk_size=None):
+        query = """UNWIND $rows AS row
+                   MATCH (a:Actor {name_id: row.name_id})-[r:ACTED_IN]->(p:Production {title_id: row.title_id})
+                   DELETE r
+                """
+        return self.__write_rows(query, rows, chunk_size)
+
+    def disconnect_episodes(self, episode_ids, chunk_size=None):
+        query = """UNWIND $rows AS episode_id
+                   MATCH (e:Episode {title_id: episode_id})-[r:EPISODE_OF]->(:Series)
+                   DELETE r
+                """
+        return self.__write_rows(query, episode_ids, chunk_size)
+
+    def get_actor_ids_of_titles(self, title_ids):
+        # actors whose statistics change when these productions or series are removed or relinked
+        with self.driver.session() as session:
+            query = """UNWIND $title_ids AS title_id
+                       MATCH (a:Actor)-[:ACTED_IN]->(:Production {title_id: title_id})
+                       RETURN a.name_id AS name_id
+                       UNION
+                       UNWIND $title_ids AS title_id
+                       MATCH (a:Actor)-[:ACTED_IN]->(:Episode)-[:EPISODE_OF]->(:Series {title_id: title_id})
+                       RETURN a.name_id AS name_id
+                    """
+            result = session.run(query, {'title_ids': list(title_ids)})
+            return [r['name_id'] for r in result]
+
+    def refresh_actor_stats(self, name_ids):
+        query = f"""UNWIND $rows AS name_id
+                    MATCH (a:Actor {{name_id: name_id}})
+                    {ACTOR_STATS}
+                 """
+        return self.__write_rows(query, list(set(name_ids)))
 
     def get_actor_connection(self, actor_id_1, actor_id_2, max_search_depth=20):
         if actor_id_1 is None or actor_id_1 == '' or actor_id_2 is None or actor_id_2 == '':
             return False
         if max_search_depth < 1 or max_search_depth > 50 or not isinstance(max_search_depth, int):
             max_search_depth = 20
+        queries = NUMERIC_CONNECTION_QUERIES if self.numeric_ids else CONNECTION_QUERIES
         with self.driver.session() as session:
-            query = f"""MATCH (a:Actor {{name_id: '{actor_id_1}'}})
-                        MATCH (b:Actor {{name_id: '{actor_id_2}'}})
-                        MATCH path = shortestPath((a)-[r:ACTED_IN*0..{max_search_depth}]-(b))
-                        RETURN path, 
-                              [x IN RELATIONSHIPS(path) | x.roles] AS roles,
-                              [x in NODES(path) | LABELS(x)] AS node_type
-                    """
-            result = session.run(query)
+            query = queries[connection_depth_bound(max_search_depth)]
+            result = session.run(query, {'actor_id_1': self.__id_value(actor_id_1), 'actor_id_2': self.__id_value(actor_id_2),
+                                         'max_search_depth': max_search_depth})
             result_row = result.single()
             if result_row is None:
                 return []
-            result_data = result_row.data()
-            path = result_data['path']
-            roles = result_data['roles']
-            node_types = result_data['node_type']
-            return_data = []
-            for p in path:
-                if p == 'ACTED_IN':
-                    return_data.append({'role': roles.pop(0)})
-                elif 'name_id' in p:
-                    a_totals = self.__get_appearance_totals_of_actor(session, p['name_id'])
-                    a = p.copy()
-                    a.update(a_totals)
-                    return_data.append({'actor': a})
-                    node_types.pop(0)
-                elif 'title_id' in p:
-                    types = node_types.pop(0)
-                    if 'Movie' in types:
-                        return_data.append({'movie': p})
-                    elif 'Episode' in types:
-                        series_details = self.__get_series_of_episode(session, p['title_id'])
-                        e = {
-                            'episode_num': p['episode_num'] if 'episode_num' in p else None,
-                            'season_num': p['season_num'] if 'season_num' in p else None,
-                            'episode_title': p['title'],
-                            'episode_id': p['title_id'],
-                            'year': p['year'] if 'year' in p else None,
-                            'parent_series': series_details['title'],
-                            'parent_series_id': series_details['imdb_id']
-                        }
-                        return_data.append({'episode': e})
+            return self.__build_connection(result_row.data())
 
-        return return_data
+    def get_actor_connections(self, actor_id_1, actor_id_2, max_search_depth=20, limit=10):
+        # list of every shortest connection (at most limit) in the get_actor_connection format; they are
+        # all read before returning, so the session goes back to the pool before the caller formats them
+        if actor_id_1 is None or actor_id_1 == '' or actor_id_2 is None or actor_id_2 == '':
+            return []
+        if max_search_depth < 1 or max_search_depth > 50 or not isinstance(max_search_depth, int):
+            max_search_depth = 20
+        queries = NUMERIC_ALL_CONNECTIONS_QUERIES if self.numeric_ids else ALL_CONNECTIONS_QUERIES
+        with self.driver.session() as session:
+            query = queries[connection_depth_bound(max_search_depth)]
+            result = session.run(query, {'actor_id_1': self.__id_value(actor_id_1), 'actor_id_2': self.__id_value(actor_id_2),
+                                         'max_search_depth': max_search_depth, 'limit': limit})
+            return [self.__build_connection(record.data()) for record in result]
+
+    def get_connection_of_path(self, path_ids):
+        # the get_actor_connection result for a path found outside neo4j (see connection_engine), given as
+        # alternating actor and title imdb ids; None when the graph no longer has one of its roles
+        name_key = self.__id_key('name_id')
+        title_key = self.__id_key('title_id')
+        with self.driver.session() as session:
+            if len(path_ids) == 1:
+                query = f"""MATCH (a:Actor {{{name_key}: $actor_id}})
+                            RETURN a AS actor
+                         """
+                result_row = session.run(query, {'actor_id': self.__id_value(path_ids[0])}).single()
+                if result_row is None:
+                    return None
+                hops = []
+                actors = [result_row['actor']]
+            else:
+                hops = [{'i': i,
+                         'name_id': self.__id_value(path_ids[i] if i % 2 == 0 else path_ids[i + 1]),
+                         'title_id': self.__id_value(path_ids[i + 1] if i % 2 == 0 else path_ids[i])}
+                        for i in range(len(path_ids) - 1)]
+                query = f"""UNWIND $hops AS hop
+                            MATCH (a:Actor {{{name_key}: hop.name_id}})-[r:ACTED_IN]->(p:Production {{{title_key}: hop.title_id}})
+                            RETURN hop.i AS i, a AS actor, r.roles AS roles, p AS production, LABELS(p) AS labels,
+                                   HEAD([(p)-[:EPISODE_OF]->(s:Series) | {{title: s.title, imdb_id: s.title_id, poster_path: s.poster_path, image_missed_at: s.image_missed_at}}]) AS series
+                         """
+                rows = {r['i']: r for r in session.run(query, {'hops': hops})}
+                if len(rows) < len(hops):
+                    return None
+                hops = [rows[i] for i in range(len(hops))]
+                actors = [hops[0]['actor']] + [hop['actor'] for hop in hops[1::2]]
+        result_data = {'path': [], 'roles': [], 'node_type': [], 'actor_totals': [], 'episode_series': []}
+        for i in range(len(path_ids)):
+            if i > 0:
+                result_data['path'].append('ACTED_IN')
+                result_data['roles'].append(hops[i - 1]['roles'])
+            if i % 2 == 0:
+                actor = dict(actors[i // 2])
+                result_data['path'].append(actor)
+                result_data['node_type'].append(['Actor', 'Person'])
+                result_data['actor_totals'].append({'movie_count': actor.get('movie_count'),
+                                                    'episode_count': actor.get('episode_count'),
+                                                    'series_count': actor.get('series_count')})
+                result_data['episode_series'].append(None)
+            else:
+                hop = hops[i - 1]
+                result_data['path'].append(dict(hop['production']))
+                result_data['node_type'].append(hop['labels'])
+                result_data['actor_totals'].append(None)
+                result_data['episode_series'].append(hop['series'] if 'Episode' in hop['labels'] else None)
+        return self.__build_connection(result_data)
 
     def get_actor_info(self, actor_id):
         if actor_id is None or actor_id == '':
             return False
         with self.driver.session() as session:
-            query = """MATCH (a:Actor {name_id: $actor_id})
-                       OPTIONAL MATCH (a)-[:ACTED_IN]->(m:Movie)
-                       OPTIONAL MATCH (a)-[:ACTED_IN]->(e:Episode)
-                       OPTIONAL MATCH (e)-[:EPISODE_OF]->(s:Series)
-                       WITH a.name AS name,
-                            a.birth_year AS birth_year,
-                            a.death_year AS death_year,
-                            COUNT(DISTINCT m) AS movie_count, 
-                            COUNT(DISTINCT e) AS episode_count,
-                            COUNT(DISTINCT s) AS series_count
-                       WHERE (movie_count + episode_count) > 0
-                       RETURN name,
-                              birth_year,
-                              death_year,
-                              movie_count, 
-                              episode_count,
-                              series_count
+            query = f"""MATCH (a:Actor {{{self.__id_key('name_id')}: $actor_id}})
+                       WHERE (a.movie_count + a.episode_count) > 0
+                       RETURN a.name AS name,
+                              a.birth_year AS birth_year,
+                              a.death_year AS death_year,
+                              a.movie_count AS movie_count,
+                              a.episode_count AS episode_count,
+                              a.series_count AS series_count
                     """
-            result = session.run(query, {'actor_id': actor_id})
-            return result.single().data()
+            # no row for an unknown actor or one whose statistics have not been computed yet
+            result_row = session.run(query, {'actor_id': self.__id_value(actor_id)}).single()
+            return result_row.data() if result_row is not None else {}
 
     def guess_actor_imdb_id(self, actor_name):
         if actor_name is None or actor_name == '':
             return False
         with self.driver.session() as session:
             query = """MATCH (a:Actor {name: $actor_name})
-                       MATCH (a)-[r:ACTED_IN]->()
-                       WITH a.name_id AS name_id,
-                            a.name AS name,
-                            COUNT(DISTINCT r) AS role_count
-                       RETURN name_id
-                       ORDER BY role_count DESC
+                       WHERE a.role_count > 0
+                       RETURN a.name_id AS name_id
+                       ORDER BY a.role_count DESC
                        LIMIT 1
                     """
-            result = session.run(query, {'actor_name': actor_name})
-            return result.single().data()
+            result_row = session.run(query, {'actor_name': actor_name}).single()
+            return result_row.data() if result_row is not None else None
 
     def actor_name_in_db(self, actor_name):
         if not actor_name:
@@ -350,13 +751,26 @@ class ActorGraph:
         if not actor_id:
             return False
         with self.driver.session() as session:
-            query = """OPTIONAL MATCH (a:Actor {name_id: $actor_id})-[:ACTED_IN]-(:Production)
+            query = f"""OPTIONAL MATCH (a:Actor {{{self.__id_key('name_id')}: $actor_id}})-[:ACTED_IN]-(:Production)
                        RETURN DISTINCT CASE WHEN EXISTS(a.name) THEN true ELSE false END AS exists
                     """
-            result = session.run(query, {'actor_id': actor_id})
+            result = session.run(query, {'actor_id': self.__id_value(actor_id)})
             return result.single().data()['exists']
 
-    def graph_totals(self):
+    def actors_ids_in_db(self, actor_ids):
+        actor_ids = [a for a in actor_ids if a]
+        if not actor_ids:
+            return {}
+        with self.driver.session() as session:
+            query = f"""UNWIND $actors AS actor
+                       OPTIONAL MATCH (a:Actor {{{self.__id_key('name_id')}: actor.key}})
+                       RETURN actor.name_id AS actor_id, a IS NOT NULL AND EXISTS((a)-[:ACTED_IN]-(:Production)) AS exists
+                    """
+            actors = [{'name_id': actor_id, 'key': self.__id_value(actor_id)} for actor_id in set(actor_ids)]
+            result = session.run(query, {'actors': actors})
+            return {r['actor_id']: r['exists'] for r in result}
+
+    def count_graph_totals(self):
         with self.driver.session() as session:
             query = """MATCH (a:Actor)
                        WITH COUNT(a) AS count
@@ -384,13 +798,143 @@ class ActorGraph:
                 return_data[f"{r['label']}_count"] = r['count']
             return return_data
 
+    def store_graph_totals(self):
+        # written at the end of a load so graph_totals reads one node instead of counting the store
+        totals = self.count_graph_totals()
+        with self.driver.session() as session:
+            query = """MERGE (m:GraphMeta {name: 'graph'})
+                       SET m += $totals, m.totals_updated = datetime()
+                    """
+            session.run(query, {'totals': totals})
+        return totals
+
+    def graph_totals(self):
+        with self.driver.session() as session:
+            query = """MATCH (m:GraphMeta {name: 'graph'})
+                       WHERE EXISTS(m.totals_updated)
+                       RETURN m {.actor_count, .movie_count, .episode_count, .series_count, .role_count} AS totals
+                    """
+            result_row = session.run(query).single()
+        if result_row is None:
+            return self.count_graph_totals()
+        return result_row['totals']
+
+    def get_most_connected_actors(self, limit):
+        with self.driver.session() as session:
+            query = """MATCH (a:Actor)
+                       RETURN a.name_id AS name_id, a.name AS name
+                       ORDER BY SIZE((a)-[:ACTED_IN]->()) DESC
+                       LIMIT $limit
+                    """
+            result = session.run(query, {'limit': limit})
+            return [r.data() for r in result]
+
+    def get_most_connected_titles(self, limit):
+        with self.driver.session() as session:
+            query = """MATCH (m:Movie)
+                       WITH m, SIZE((m)<-[:ACTED_IN]-()) AS degree
+                       ORDER BY degree DESC
+                       LIMIT $limit
+                       RETURN m.title_id AS title_id, m.title AS title, 'movie' AS type
+                       UNION ALL
+                       MATCH (s:Series)
+                       WITH s, SIZE((s)<-[:EPISODE_OF]-()) AS degree
+                       ORDER BY degree DESC
+                       LIMIT $limit
+                       RETURN s.title_id AS title_id, s.title AS title, 'series' AS type
+                    """
+            result = session.run(query, {'limit': limit})
+            return [r.data() for r in result]
+
+    # rows of {name_id / title_id, profile_path / poster_path, image_missed_at}: '' as the path records that
+    # tmdb has no image, image_missed_at the epoch seconds when that was found (None for a found image)
+    def set_actor_images(self, rows):
+        with self.driver.session() as session:
+            query = """UNWIND $rows AS row
+                       MATCH (a:Actor {name_id: row.name_id})
+                       SET a.profile_path = row.profile_path, a.image_missed_at = row.image_missed_at
+                    """
+            session.run(query, {'rows': rows})
+
+    def set_title_images(self, rows):
+        with self.driver.session() as session:
+            query = """UNWIND $rows AS row
+                       OPTIONAL MATCH (m:Movie {title_id: row.title_id})
+                       OPTIONAL MATCH (s:Series {title_id: row.title_id})
+                       WITH row, COALESCE(m, s) AS p
+                       WHERE p IS NOT NULL
+                       SET p.poster_path = row.poster_path, p.image_missed_at = row.image_missed_at
+                    """
+            session.run(query, {'rows': rows})
+
+    def copy_episode_numbers(self):
+        # neo4j-admin import leaves season and episode numbers on EPISODE_OF, the graph keeps them on the episode
+        with self.driver.session() as session:
+            query = """CALL apoc.periodic.iterate("MATCH (e:Episode)-[r:EPISODE_OF]->() RETURN e, r",
+                                                  "SET e.season_num = r.season_num, e.episode_num = r.episode_num
+                                                   REMOVE r.season_num, r.episode_num",
+                                                  {batchSize: 10000, parallel: true})
+                       YIELD total
+                       RETURN total
+                    """
+            return session.run(query).single()['total']
+
+    def compute_actor_stats(self):
+        # materializes each actor's appearance counts as properties so reads never expand their roles,
+        # add_role and connect_episode keep them current for rows added after a load
+        with self.driver.session() as session:
+            query = """CALL apoc.periodic.iterate("MATCH (a:Actor) RETURN a", $stats, {batchSize: 10000, parallel: true})
+                       YIELD total
+                       RETURN total
+                    """
+            return session.run(query, {'stats': ACTOR_STATS}).single()['total']
+
+    def index_random_actors(self):
+        # numbers every actor with at least one role densely from 0 so a random actor is a single index
+        # lookup, the count is kept on the graph metadata node; run again after every load. the new numbers
+        # overwrite the old ones in batches, each batch taking the next block of numbers from a counter on
+        # the metadata node, so lookups keep hitting an indexed actor while it runs
+        with self.driver.session() as session:
+            session.run("MERGE (m:GraphMeta {name: 'graph'}) SET m.next_rand_idx = 0").consume()
+            query = """CALL apoc.periodic.iterate("MATCH (a:Actor) WHERE (a)-[:ACTED_IN]->() RETURN a",
+                                                  "MATCH (m:GraphMeta {name: 'graph'})
+                                                   WITH m, m.next_rand_idx AS first_idx
+                                                   SET m.next_rand_idx = first_idx + SIZE($_batch)
+                                                   WITH first_idx
+                                                   UNWIND RANGE(0, SIZE($_batch) - 1) AS i
+                                                   WITH $_batch[i].a AS a, first_idx + i AS rand_idx
+                                                   SET a.rand_idx = rand_idx",
+                                                  {batchSize: 10000, batchMode: 'BATCH'})
+                       YIELD total
+                       MATCH (m:GraphMeta {name: 'graph'})
+                       SET m.random_actor_count = m.next_rand_idx
+                       REMOVE m.next_rand_idx
+                       RETURN m.random_actor_count AS total
+                    """
+            total = session.run(query).single()['total']
+            # only actors that lost all their roles still carry a number from the previous run
+            query = """CALL apoc.periodic.iterate("MATCH (a:Actor) WHERE EXISTS(a.rand_idx) AND NOT (a)-[:ACTED_IN]->() RETURN a",
+                                                  "REMOVE a.rand_idx", {batchSize: 10000})
+                    """
+            session.run(query).consume()
+            return total
+
     def get_random_actor(self):
         with self.driver.session() as session:
-            query = """MATCH ()-[roles:ACTED_IN]->()
-                       WITH COUNT(roles) AS role_count
-                       MATCH (a:Actor)-[r:ACTED_IN]->()
-                       WHERE id(r) = toInteger(rand() * role_count)
+            query = """MATCH (m:GraphMeta {name: 'graph'})
+                       WHERE m.random_actor_count > 0
+                       MATCH (a:Actor {rand_idx: toInteger(rand() * m.random_actor_count)})
                        RETURN a.name AS name, a.name_id AS imdb_id
                     """
-            result = session.run(query)
-            return result.single().data()
\ No newline at end of file
+            result_row = session.run(query).single()
+            if result_row is None:
+                # actors have not been indexed yet, fall back to probing random relationship ids
+                query = """MATCH ()-[roles:ACTED_IN]->()
+                           WITH COUNT(roles) AS role_count
+                           MATCH (a:Actor)-[r:ACTED_IN]->()
+                           WHERE id(r) = toInteger(rand() * role_count)
+                           RETURN a.name AS name, a.name_id AS imdb_id
+                           LIMIT 1
+                        """
+                result_row = session.run(query).single()
+            return result_row.data() if result_row is not None else None
@@ -1,156 +1,336 @@
 import os
+import json
+import time
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from actor_graph import ActorGraph
+from actor_graph import ActorGraph, graph_version
+from cache import LRUCache, SQLiteCache, TieredCache, MISSING
+from connection_engine import ConnectionEngine
+from random_actor_pool import RandomActorPool
+import metrics
+from tmdb_images import (get_images, get_person, get_people, find_tmdb_id, IMAGE_PREFIX, SMALL_IMAGE_PREFIX,
+                         IMAGE_CACHE_NEGATIVE_TTL)
 import tmdbsimple as tmdb
 
 #config
 load_dotenv()
 DEBUG = os.getenv('FLASK_DEBUG')
-tmdb.API_KEY = os.getenv('TMDB_API_KEY')
 db_user = os.getenv('NEO4J_USER')
 db_pass = os.getenv('NEO4J_PASS')
 
+GRAPH_TOTALS_TTL = int(os.getenv('GRAPH_TOTALS_TTL', 300))
+# 'neo4j' runs shortestPath in the database, 'bfs' searches the in-process connection snapshot written by
+# create_batch_files.py (neo4j answers while there is none); a request can pick either with ?engine=
+CONNECTION_ENGINE = os.getenv('CONNECTION_ENGINE', 'neo4j')
+CONNECTION_SNAPSHOT_FILE = os.getenv('CONNECTION_SNAPSHOT_FILE', 'connection_snapshot.bin')
+# connections to the hub actors indexed here (see build_hub_index.py) are read from their bfs trees
+# whichever engine is asked for
+HUB_INDEX_DIR = os.getenv('HUB_INDEX_DIR', 'hub_index')
+# number of shortest connections streamed by /actor/connections unless ?limit= asks for more, up to the max
+CONNECTIONS_LIMIT = int(os.getenv('CONNECTIONS_LIMIT', 10))
+CONNECTIONS_MAX_LIMIT = int(os.getenv('CONNECTIONS_MAX_LIMIT', 100))
+CONNECTION_CACHE_SIZE = int(os.getenv('CONNECTION_CACHE_SIZE', 10000))
+CONNECTION_CACHE_TTL = int(os.getenv('CONNECTION_CACHE_TTL', 24 * 3600))
+# sqlite file shared by the workers on the host, unset keeps connection results per process
+CONNECTION_CACHE_PATH = os.getenv('CONNECTION_CACHE_PATH')
+
+# keyed by graph version so a finished load or drop is picked up before the ttl runs out
+graph_totals_cache = LRUCache(maxsize=1, ttl=GRAPH_TOTALS_TTL)
+# /actor/connection paths as read from the graph, keyed by graph version and the actor pair in sorted
+# order; they are formatted on every read, so an image lookup that failed is retried by the next request
+# rather than cached (the image cache keeps the ones that succeeded)
+connection_cache = TieredCache(LRUCache(CONNECTION_CACHE_SIZE, CONNECTION_CACHE_TTL),
+                               SQLiteCache(CONNECTION_CACHE_PATH, CONNECTION_CACHE_TTL) if CONNECTION_CACHE_PATH else None)
+
+connection_engine = ConnectionEngine(CONNECTION_SNAPSHOT_FILE, version=graph_version, hub_dir=HUB_INDEX_DIR)
+
 app = Flask(__name__)
 app.config.from_object(__name__)
 CORS(app, resources={r'/*': {'origins': '*'}})
 
 
-def get_poster(title, imdb_id, prod_type):
-    search = tmdb.Search()
-    results = search.movie(query=title) if prod_type == 'movie' else search.tv(query=title)
-    if results['total_results'] == 0:
-        return None
-    for r in results['results']:
-        cur_res = tmdb.Movies(r['id']).external_ids() if prod_type == 'movie' else tmdb.TV(r['id']).external_ids()
-        if 'imdb_id' in cur_res and cur_res['imdb_id'] == imdb_id:
-            prod = tmdb.Movies(r['id']).info() if prod_type == 'movie' else tmdb.TV(r['id']).info()
-            if 'poster_path' not in prod or prod['poster_path'] is None or prod['poster_path'] == '':
-                return None
-            return 'https://image.tmdb.org/t/p/w185' + prod['poster_path']
-    return None
-
-
-def get_profile_pic(actor_name, imdb_id):
-    path_prefix = 'https://image.tmdb.org/t/p/w185'
-    search = tmdb.Search()
-    results = search.person(query=actor_name)
-    if results['total_results'] == 0:
-        return None
-    elif results['total_results'] == 1:
-        single_res = results['results'][0]
-        if 'profile_path' not in single_res or single_res['profile_path'] is None or single_res['profile_path'] == '':
-            return None
-        return 'https://image.tmdb.org/t/p/w185' + single_res['profile_path']
-    else:
-        for r in results['results']:
-            actor = tmdb.People(r['id']).info()
-            if 'imdb_id' in actor and actor['imdb_id'] == imdb_id:
-                if 'profile_path' not in actor or actor['profile_path'] is None or actor['profile_path'] == '':
-                    return None
-                return path_prefix + actor['profile_path']
-        # if imdb_ids don't match we just return the first profile pic we find from the name, it is usually correct
-        for r in results['results']:
-            if 'profile_path' in r and r['profile_path'] != '' and r['profile_path'] is not None:
-                return path_prefix + r['profile_path']
-    return None
+# per request stage timings and neo4j / tmdb counts, sent back as a Server-Timing header and logged as
+# one json line; the header of a streamed response covers the time until its headers are sent, its log
+# line and latency are recorded once its first line is ready
+@app.before_request
+def start_request_timing():
+    metrics.start_request(request.args.get('profile'))
+
+
+@app.after_request
+def finish_request_timing(response):
+    timings = metrics.current()
+    if timings is not None:
+        args = (timings, request.method, request.path, request.endpoint or 'unmatched', response.status_code)
+        if response.is_streamed:
+            response.headers['Server-Timing'], response.response = metrics.finish_streamed_request(*args, response.response)
+        else:
+            response.headers['Server-Timing'] = metrics.finish_request(*args)
+    return response
+
+
+@app.teardown_request
+def end_request_timing(exc):
+    metrics.end_request()
+
+
+@app.route('/metrics', methods={'GET'})
+def get_metrics():
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/actor/<tmdb_id>', methods={'GET'})
 def get_actor_info(tmdb_id):
     response_obj = {'status': 'success'}
     if request.method == 'GET':
-        profile = tmdb.People(tmdb_id).info()
+        profile = get_person(tmdb_id)
         with ActorGraph(db_user, db_pass) as graph:
             if profile['imdb_id'] is None or profile['imdb_id'] == '' or not graph.actor_id_in_db(profile['imdb_id']):
                 result = graph.guess_actor_imdb_id(profile['name'])
-                response_obj['imdb_id'] = result['name_id']
+                response_obj['imdb_id'] = result['name_id'] if result else None
             else:
                 response_obj['imdb_id'] = profile['imdb_id']
             image_url = None
             if 'profile_path' in profile and profile['profile_path'] != '' and profile['profile_path'] is not None:
-                image_url = 'https://image.tmdb.org/t/p/w185' + profile['profile_path']
+                image_url = IMAGE_PREFIX + profile['profile_path']
             response_obj['img_url'] = image_url
             info = graph.get_actor_info(response_obj['imdb_id'])
-            response_obj.update(info)
+            if info:
+                response_obj.update(info)
 
     return jsonify(response_obj)
 
 
+def find_connection(graph, first_actor_id, second_actor_id, max_search_depth, engine):
+    if first_actor_id and second_actor_id:
+        try:
+            with metrics.stage('hub_lookup'):
+                path = connection_engine.hub_path(first_actor_id, second_actor_id, max_search_depth)
+            if path is None and engine == 'bfs':
+                with metrics.stage('bfs_search'):
+                    path = connection_engine.shortest_path(first_actor_id, second_actor_id, max_search_depth)
+        except (OSError, ValueError):
+            # an id that is not an imdb name id
+            app.logger.exception('bfs connection engine unavailable')
+            path = None
+        # [] when the snapshot knows both actors and they are not connected, None when it does not know
+        # one of them, which may have been added since the snapshot was written
+        if path == []:
+            return []
+        if path is not None:
+            with metrics.stage('hydrate'):
+                connection = graph.get_connection_of_path(path)
+            # None when the snapshot is behind the graph, which then answers itself
+            if connection is not None:
+                return connection
+    with metrics.stage('path_search'):
+        return graph.get_actor_connection(first_actor_id, second_actor_id, max_search_depth=max_search_depth)
+
+
+def stored_image_path(path, missed_at):
+    # '' stored by cache_images.py means tmdb had no image at missed_at, which is trusted for the same
+    # negative ttl as image_cache; an older miss, or one stored without a time, is looked up again
+    if path == '' and (missed_at is None or time.time() - missed_at > IMAGE_CACHE_NEGATIVE_TTL):
+        return None
+    return path
+
+
+def connection_images(connection):
+    # the image url of every actor, movie and episode of a get_actor_connection result in order, with the
+    # (index, lookup) pairs still to be resolved by get_images; image paths already stored on the graph
+    # nodes are used as is ('' meaning tmdb has no image), only the rest are looked up on tmdb
+    images = []
+    pending = []
+    for item in connection:
+        if 'movie' in item:
+            lookup = ('poster', item['movie']['title'], item['movie']['title_id'], 'movie')
+            stored_path = stored_image_path(item['movie'].get('poster_path'), item['movie'].get('image_missed_at'))
+        elif 'episode' in item:
+            lookup = ('poster', item['episode']['parent_series'], item['episode']['parent_series_id'], 'episode')
+            stored_path = stored_image_path(item['episode'].get('parent_series_poster_path'),
+                                            item['episode'].get('parent_series_image_missed_at'))
+        elif 'actor' in item:
+            lookup = ('profile', item['actor']['name'], item['actor']['name_id'])
+            stored_path = stored_image_path(item['actor'].get('profile_path'), item['actor'].get('image_missed_at'))
+        else:
+            continue
+        if stored_path is None:
+            pending.append((len(images), lookup))
+        images.append(IMAGE_PREFIX + stored_path if stored_path else None)
+    return images, pending
+
+
+def format_connection_items(connection, images):
+    # the response items of a get_actor_connection result and its number of steps
+    images = iter(images)
+    items = []
+    role_count = 0
+    steps = -1
+    for item in connection:
+        type = list(item.keys())[0]
+        if type == 'movie':
+            poster = next(images)
+            d = {
+                'type': type,
+                'title': item['movie']['title'],
+                'img_url': poster,
+                'year': item['movie']['year'] if 'year' in item['movie'] else None
+            }
+            items.append(d)
+        elif type == 'episode':
+            poster = next(images)
+            d = {
+                'type': type,
+                'parent_series': item['episode']['parent_series'],
+                'img_url': poster,
+                'episode_num': item['episode']['episode_num'] if 'episode_num' in item['episode'] else None,
+                'season_num': item['episode']['season_num'] if 'season_num' in item['episode'] else None,
+                'year': item['episode']['year']
+            }
+            items.append(d)
+        elif type == 'actor':
+            steps += 1
+            profile = next(images)
+            d = {
+                'type': type,
+                'name': item['actor']['name'],
+                'birth_year': item['actor']['birth_year'] if 'birth_year' in item['actor'] else None,
+                'death_year': item['actor']['death_year'] if 'death_year' in item['actor'] else None,
+                'img_url': profile,
+                'movie_count': item['actor']['movie_count'],
+                'episode_count': item['actor']['episode_count'],
+                'series_count': item['actor']['series_count']
+            }
+            items.append(d)
+        elif type == 'role':
+            role_str = ''
+            if 'role' in item and item['role'] != '' and item['role'] is not None:
+                roles = item['role'].split(',')
+                role_len = len(roles)
+                for i, r in enumerate(roles):
+                    if i == (role_len-1) and role_len > 1:
+                        role_str += ' and '
+                    elif i > 0:
+                        role_str += ', '
+                    role_str += f'"{r}"'
+            else:
+                role_str = None
+            d = {
+                'type': type,
+                'roles': role_str,
+                'direction': 'down' if role_count % 2 == 0 else 'up'
+            }
+            role_count += 1
+            items.append(d)
+    return items, steps
+
+
+def format_connection(connection):
+    images, pending = connection_images(connection)
+    with metrics.stage('tmdb'):
+        for (index, lookup), image in zip(pending, get_images([lookup for index, lookup in pending])):
+            images[index] = image
+    return format_connection_items(connection, images)
+
+
+def connection_cache_key(first_actor_id, second_actor_id):
+    return f'{graph_version()}:' + ':'.join(sorted((first_actor_id, second_actor_id)))
+
+
+def get_cached_connection(first_actor_id, second_actor_id, max_search_depth):
+    # a cached search answers any depth it determines: a shortest connection of some length answers
+    # every depth (with no connection below that length) and a search that found none answers the
+    # depths up to its own
+    entry = connection_cache.get(connection_cache_key(first_actor_id, second_actor_id))
+    if entry is MISSING:
+        return MISSING
+    if entry['length'] is None:
+        return [] if max_search_depth <= entry['depth'] else MISSING
+    if entry['length'] > max_search_depth:
+        return []
+    if entry['first'] != first_actor_id:
+        # the same path read from the other end
+        return entry['connection'][::-1]
+    return entry['connection']
+
+
+def cache_connection(first_actor_id, second_actor_id, max_search_depth, connection):
+    connection_cache.set(connection_cache_key(first_actor_id, second_actor_id), {
+        'first': first_actor_id,
+        'depth': max_search_depth,
+        # number of roles on the path
+        'length': sum(1 for item in connection if 'role' in item) if connection else None,
+        'connection': connection
+    })
+
+
 @app.route('/actor/connection/<first_actor_id>/<second_actor_id>/<max_search_depth>', methods={'GET'})
 def get_actor_connection(first_actor_id, second_actor_id, max_search_depth):
     response_obj = {'status': 'success'}
     if request.method == 'GET':
-        with ActorGraph(db_user, db_pass) as graph:
-            max_search_depth = int(max_search_depth)
-            if not isinstance(max_search_depth, int) or max_search_depth < 1 or max_search_depth > 50:
-                max_search_depth = 20
-            connection = graph.get_actor_connection(first_actor_id, second_actor_id, max_search_depth=max_search_depth)
-            response_obj['connection'] = []
-            role_count = 0
-            steps = -1
-            for item in connection:
-                type = list(item.keys())[0]
-                if type == 'movie':
-                    poster = get_poster(item['movie']['title'], item['movie']['title_id'], type)
-                    d = {
-                        'type': type,
-                        'title': item['movie']['title'],
-                        'img_url': poster,
-                        'year': item['movie']['year'] if 'year' in item['movie'] else None
-                    }
-                    response_obj['connection'].append(d)
-                elif type == 'episode':
-                    poster = get_poster(item['episode']['parent_series'], item['episode']['parent_series_id'], type)
-                    d = {
-                        'type': type,
-                        'parent_series': item['episode']['parent_series'],
-                        'img_url': poster,
-                        'episode_num': item['episode']['episode_num'] if 'episode_num' in item['episode'] else None,
-                        'season_num': item['episode']['season_num'] if 'season_num' in item['episode'] else None,
-                        'year': item['episode']['year']
-                    }
-                    response_obj['connection'].append(d)
-                elif type == 'actor':
-                    steps += 1
-                    profile = get_profile_pic(item['actor']['name'], item['actor']['name_id'])
-                    d = {
-                        'type': type,
-                        'name': item['actor']['name'],
-                        'birth_year': item['actor']['birth_year'] if 'birth_year' in item['actor'] else None,
-                        'death_year': item['actor']['death_year'] if 'death_year' in item['actor'] else None,
-                        'img_url': profile,
-                        'movie_count': item['actor']['movie_count'],
-                        'episode_count': item['actor']['episode_count'],
-                        'series_count': item['actor']['series_count']
-                    }
-                    response_obj['connection'].append(d)
-                elif type == 'role':
-                    role_str = ''
-                    if 'role' in item and item['role'] != '' and item['role'] is not None:
-                        roles = item['role'].split(',')
-                        role_len = len(roles)
-                        for i, r in enumerate(roles):
-                            if i == (role_len-1) and role_len > 1:
-                                role_str += ' and '
-                            elif i > 0:
-                                role_str += ', '
-                            role_str += f'"{r}"'
-                    else:
-                        role_str = None
-                    d = {
-                        'type': type,
-                        'roles': role_str,
-                        'direction': 'down' if role_count % 2 == 0 else 'up'
-                    }
-                    role_count += 1
-                    response_obj['connection'].append(d)
-            response_obj['steps'] = steps
+        max_search_depth = int(max_search_depth)
+        if not isinstance(max_search_depth, int) or max_search_depth < 1 or max_search_depth > 50:
+            max_search_depth = 20
+        connection = get_cached_connection(first_actor_id, second_actor_id, max_search_depth)
+        if connection is MISSING:
+            with ActorGraph(db_user, db_pass) as graph:
+                connection = find_connection(graph, first_actor_id, second_actor_id, max_search_depth,
+                                             request.args.get('engine', CONNECTION_ENGINE))
+            cache_connection(first_actor_id, second_actor_id, max_search_depth, connection)
+        else:
+            metrics.count('connection_cache_hits')
+        response_obj['connection'], response_obj['steps'] = format_connection(connection)
 
     return jsonify(response_obj)
 
 
+@app.route('/actor/degrees/<hub_actor_id>/<actor_id>', methods={'GET'})
+def get_degrees_to_hub(hub_actor_id, actor_id):
+    # degrees of separation read from a hub index; 'degrees' is None when the two are not connected and
+    # 'hub' False when hub_actor_id has no index
+    response_obj = {'status': 'success'}
+    if request.method == 'GET':
+        try:
+            response_obj['hub'], response_obj['degrees'] = connection_engine.degrees_to_hub(hub_actor_id, actor_id)
+        except (OSError, ValueError):
+            app.logger.exception('hub index unavailable')
+            response_obj['hub'], response_obj['degrees'] = False, None
+
+    return jsonify(response_obj)
+
+
+@app.route('/actor/connections/<first_actor_id>/<second_actor_id>/<max_search_depth>', methods={'GET'})
+def get_actor_connections(first_actor_id, second_actor_id, max_search_depth):
+    # every shortest connection (at most ?limit= of them) as newline delimited json: a line of
+    # {connection, steps} per path, sent as soon as that path's images are resolved, then a closing
+    # {status, count} line. the paths are read first so no session is held while tmdb is waited on
+    max_search_depth = int(max_search_depth)
+    if max_search_depth < 1 or max_search_depth > 50:
+        max_search_depth = 20
+    limit = request.args.get('limit', CONNECTIONS_LIMIT, type=int)
+    limit = max(1, min(limit, CONNECTIONS_MAX_LIMIT))
+
+    def generate():
+        count = 0
+        try:
+            with ActorGraph(db_user, db_pass) as graph:
+                connections = graph.get_actor_connections(first_actor_id, second_actor_id,
+                                                          max_search_depth=max_search_depth, limit=limit)
+            for connection in connections:
+                items, steps = format_connection(connection)
+                count += 1
+                yield json.dumps({'connection': items, 'steps': steps}) + '\n'
+        except Exception:
+            # the 200 response has been sent already, so the failure is reported in the stream itself
+            app.logger.exception('connections stream failed')
+            yield json.dumps({'status': 'error', 'count': count}) + '\n'
+            return
+        yield json.dumps({'status': 'success', 'count': count}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
 @app.route('/actor/search/<search_term>', methods={'GET'})
 def get_actor_list(search_term):
     response_obj = {'status': 'success'}
@@ -159,15 +339,15 @@ def get_actor_list(search_term):
         results = search.person(query=search_term)
         actor_list = []
         if results['total_results'] > 0:
+            people = get_people([res['id'] for res in results['results']])
             with ActorGraph(db_user, db_pass) as graph:
-                for res in results['results']:
-                    person_res = tmdb.People(res['id']).info()
-                    if 'imdb_id' in person_res and graph.actor_id_in_db(person_res['imdb_id']):
-                        # if graph.actor_name_in_db(res['name']):
-                        profile_path = ''
-                        if 'profile_path' in person_res and person_res['profile_path'] != '' and person_res['profile_path'] is not None:
-                            profile_path = 'https://image.tmdb.org/t/p/w45' + person_res['profile_path']
-                        actor_list.append({'name': res['name'], 'tmdb_id': res['id'], 'imdb_id': person_res['imdb_id'], 'profile_path': profile_path})
+                in_db = graph.actors_ids_in_db([p['imdb_id'] for p in people if p is not None])
+            for res, person_res in zip(results['results'], people):
+                if person_res is not None and in_db.get(person_res['imdb_id']):
+                    profile_path = ''
+                    if person_res['profile_path']:
+                        profile_path = SMALL_IMAGE_PREFIX + person_res['profile_path']
+                    actor_list.append({'name': res['name'], 'tmdb_id': res['id'], 'imdb_id': person_res['imdb_id'], 'profile_path': profile_path})
         response_obj['actor_list'] = actor_list
 
     return jsonify(response_obj)
@@ -177,34 +357,49 @@ def get_actor_list(search_term):
 def get_graph_totals():
     response_obj = {'status': 'success'}
     if request.method == 'GET':
-        with ActorGraph(db_user, db_pass) as graph:
-            totals = graph.graph_totals()
-            response_obj['totals'] = totals
+        version = graph_version()
+        totals = graph_totals_cache.get(version)
+        if totals is MISSING:
+            with ActorGraph(db_user, db_pass) as graph:
+                totals = graph.graph_totals()
+            graph_totals_cache.set(version, totals)
+        response_obj['totals'] = totals
 
     return jsonify(response_obj)
 
+
+def fetch_random_actor():
+    with ActorGraph(db_user, db_pass) as graph:
+        rand = graph.get_random_actor()
+    if rand is None:
+        return None
+    tmdb_id = find_tmdb_id(rand['name'], rand['imdb_id'])
+    if tmdb_id is None:
+        return None
+    return {
+        'name': rand['name'],
+        'imdb_id': rand['imdb_id'],
+        'tmdb_id': tmdb_id
+    }
+
+
+random_actor_pool = RandomActorPool(fetch_random_actor, size=int(os.getenv('RANDOM_ACTOR_POOL_SIZE', 20)),
+                                    version=graph_version)
+
+
 # need cache busting random var so safari does not cache results
 @app.route('/actor/random/<cache_buster>', methods={'GET'})
 def get_random_actor(cache_buster):
     response_obj = {'status': 'success'}
     if request.method == 'GET':
-        with ActorGraph(db_user, db_pass) as graph:
-            for i in range(10):
-                rand = graph.get_random_actor()
-                # response_obj['rand'] = rand
-                search = tmdb.Search()
-                results = search.person(query=rand['name'])
-                if results['total_results'] == 0:
-                    continue
-                for r in results['results']:
-                    actor = tmdb.People(r['id']).info()
-                    if 'imdb_id' in actor and actor['imdb_id'] == rand['imdb_id']:
-                        response_obj['rand'] = {
-                            'name': rand['name'],
-                            'imdb_id': rand['imdb_id'],
-                            'tmdb_id': r['id']
-                        }
-                        break
+        rand = random_actor_pool.get()
+        # the pool is empty right after start up or under a burst of requests
+        for i in range(10):
+            if rand is not None:
+                break
+            rand = fetch_random_actor()
+        if rand is not None:
+            response_obj['rand'] = rand
 
     return jsonify(response_obj)
 
@@ -0,0 +1 @@
+from async_app import app
@@ -0,0 +1,234 @@
+import os
+import json
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from actor_graph import ActorGraph, graph_version, close_drivers
+from cache import MISSING
+from app import (db_user, db_pass, CONNECTION_ENGINE, CONNECTIONS_LIMIT, CONNECTIONS_MAX_LIMIT, connection_engine,
+                 connection_cache, graph_totals_cache, random_actor_pool, fetch_random_actor, find_connection,
+                 connection_images, format_connection_items, get_cached_connection, cache_connection)
+from tmdb_images import IMAGE_PREFIX, SMALL_IMAGE_PREFIX
+import tmdb_images_async as tmdb_async
+import metrics
+
+# the endpoints of app.py as an asgi app, so one worker keeps hundreds of requests in flight while they
+# wait on tmdb and neo4j: tmdb is called over an async http client, and since the neo4j driver pinned in
+# requirements.txt (4.1) has no async api, graph calls run on a thread pool sized like the driver's
+# connection pool. serve it with
+#   uvicorn asgi:app --workers <n>
+# or gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+
+GRAPH_THREADS = int(os.getenv('GRAPH_THREADS', os.getenv('NEO4J_POOL_SIZE', 50)))
+
+_graph_executor = ThreadPoolExecutor(max_workers=GRAPH_THREADS, thread_name_prefix='graph')
+logger = logging.getLogger(__name__)
+
+
+async def in_thread(func, *args):
+    # in the request's context, so the work is counted against it
+    return await asyncio.get_running_loop().run_in_executor(_graph_executor, contextvars.copy_context().run, func, *args)
+
+
+async def in_graph(func, *args):
+    # func(graph, *args) on a graph thread
+    def call():
+        with ActorGraph(db_user, db_pass) as graph:
+            return func(graph, *args)
+    return await in_thread(call)
+
+
+async def in_cache_thread(func, *args):
+    # connection cache calls block on sqlite when it has a shared tier, those run on a graph thread
+    if connection_cache.shared is None:
+        return func(*args)
+    return await in_thread(func, *args)
+
+
+async def format_connection(connection):
+    images, pending = connection_images(connection)
+    with metrics.stage('tmdb'):
+        for (index, lookup), image in zip(pending, await tmdb_async.get_images([lookup for index, lookup in pending])):
+            images[index] = image
+    return format_connection_items(connection, images)
+
+
+async def get_actor_info(request):
+    response_obj = {'status': 'success'}
+    profile = await tmdb_async.get_person(request.path_params['tmdb_id'])
+
+    def actor_info(graph):
+        if profile['imdb_id'] is None or profile['imdb_id'] == '' or not graph.actor_id_in_db(profile['imdb_id']):
+            result = graph.guess_actor_imdb_id(profile['name'])
+            imdb_id = result['name_id'] if result else None
+        else:
+            imdb_id = profile['imdb_id']
+        return imdb_id, graph.get_actor_info(imdb_id)
+
+    response_obj['imdb_id'], info = await in_graph(actor_info)
+    image_url = None
+    if 'profile_path' in profile and profile['profile_path'] != '' and profile['profile_path'] is not None:
+        image_url = IMAGE_PREFIX + profile['profile_path']
+    response_obj['img_url'] = image_url
+    if info:
+        response_obj.update(info)
+    return JSONResponse(response_obj)
+
+
+def search_depth(max_search_depth):
+    max_search_depth = int(max_search_depth)
+    if max_search_depth < 1 or max_search_depth > 50:
+        max_search_depth = 20
+    return max_search_depth
+
+
+async def get_actor_connection(request):
+    response_obj = {'status': 'success'}
+    first_actor_id = request.path_params['first_actor_id']
+    second_actor_id = request.path_params['second_actor_id']
+    max_search_depth = search_depth(request.path_params['max_search_depth'])
+    connection = await in_cache_thread(get_cached_connection, first_actor_id, second_actor_id, max_search_depth)
+    if connection is MISSING:
+        connection = await in_graph(find_connection, first_actor_id, second_actor_id, max_search_depth,
+                                    request.query_params.get('engine', CONNECTION_ENGINE))
+        await in_cache_thread(cache_connection, first_actor_id, second_actor_id, max_search_depth, connection)
+    else:
+        metrics.count('connection_cache_hits')
+    response_obj['connection'], response_obj['steps'] = await format_connection(connection)
+    return JSONResponse(response_obj)
+
+
+async def get_actor_connections(request):
+    # the newline delimited json stream of app.get_actor_connections
+    first_actor_id = request.path_params['first_actor_id']
+    second_actor_id = request.path_params['second_actor_id']
+    max_search_depth = search_depth(request.path_params['max_search_depth'])
+    try:
+        limit = int(request.query_params.get('limit', CONNECTIONS_LIMIT))
+    except ValueError:
+        limit = CONNECTIONS_LIMIT
+    limit = max(1, min(limit, CONNECTIONS_MAX_LIMIT))
+
+    async def generate():
+        count = 0
+        try:
+            # the paths are read first, so the session is back in the pool while tmdb is waited on
+            connections = await in_graph(lambda graph: graph.get_actor_connections(
+                first_actor_id, second_actor_id, max_search_depth=max_search_depth, limit=limit))
+            for connection in connections:
+                items, steps = await format_connection(connection)
+                count += 1
+                yield json.dumps({'connection': items, 'steps': steps}) + '\n'
+        except Exception:
+            logger.exception('connections stream failed')
+            yield json.dumps({'status': 'error', 'count': count}) + '\n'
+            return
+        yield json.dumps({'status': 'success', 'count': count}) + '\n'
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+async def get_degrees_to_hub(request):
+    response_obj = {'status': 'success'}
+    try:
+        response_obj['hub'], response_obj['degrees'] = await in_thread(
+            connection_engine.degrees_to_hub, request.path_params['hub_actor_id'], request.path_params['actor_id'])
+    except (OSError, ValueError):
+        logger.exception('hub index unavailable')
+        response_obj['hub'], response_obj['degrees'] = False, None
+    return JSONResponse(response_obj)
+
+
+async def get_actor_list(request):
+    response_obj = {'status': 'success'}
+    results = await tmdb_async.search_people(request.path_params['search_term'])
+    actor_list = []
+    if results['total_results'] > 0:
+        people = await tmdb_async.get_people([res['id'] for res in results['results']])
+        in_db = await in_graph(lambda graph: graph.actors_ids_in_db([p['imdb_id'] for p in people if p is not None]))
+        for res, person_res in zip(results['results'], people):
+            if person_res is not None and in_db.get(person_res['imdb_id']):
+                profile_path = ''
+                if person_res['profile_path']:
+                    profile_path = SMALL_IMAGE_PREFIX + person_res['profile_path']
+                actor_list.append({'name': res['name'], 'tmdb_id': res['id'], 'imdb_id': person_res['imdb_id'], 'profile_path': profile_path})
+    response_obj['actor_list'] = actor_list
+    return JSONResponse(response_obj)
+
+
+async def get_graph_totals(request):
+    response_obj = {'status': 'success'}
+    version = graph_version()
+    totals = graph_totals_cache.get(version)
+    if totals is MISSING:
+        totals = await in_graph(lambda graph: graph.graph_totals())
+        graph_totals_cache.set(version, totals)
+    response_obj['totals'] = totals
+    return JSONResponse(response_obj)
+
+
+async def get_random_actor(request):
+    response_obj = {'status': 'success'}
+    rand = random_actor_pool.get()
+    for i in range(10):
+        if rand is not None:
+            break
+        rand = await in_thread(fetch_random_actor)
+    if rand is not None:
+        response_obj['rand'] = rand
+    return JSONResponse(response_obj)
+
+
+async def get_metrics(request):
+    return PlainTextResponse(metrics.render_metrics(), media_type='text/plain; version=0.0.4')
+
+
+class RequestTiming(BaseHTTPMiddleware):
+    # the Server-Timing header and request log of app.py; the endpoint runs in a task started after the
+    # timings are set, so it and the threads it uses share them. every response reaches the middleware as
+    # a stream, so the header covers the time until the endpoint has sent its headers and the request is
+    # recorded on the first chunk of the body
+    async def dispatch(self, request, call_next):
+        timings = metrics.start_request(request.query_params.get('profile'))
+        try:
+            response = await call_next(request)
+        finally:
+            metrics.end_request()
+        endpoint = request.scope.get('endpoint')
+        response.headers['Server-Timing'], response.body_iterator = metrics.finish_streamed_request(
+            timings, request.method, request.url.path, endpoint.__name__ if endpoint else 'unmatched', response.status_code,
+            response.body_iterator)
+        return response
+
+
+async def default(request):
+    return JSONResponse({'status': 'success'})
+
+
+async def shutdown():
+    await tmdb_async.close_client()
+    close_drivers()
+
+
+app = Starlette(
+    routes=[
+        Route('/actor/connection/{first_actor_id}/{second_actor_id}/{max_search_depth}', get_actor_connection),
+        Route('/actor/connections/{first_actor_id}/{second_actor_id}/{max_search_depth}', get_actor_connections),
+        Route('/actor/degrees/{hub_actor_id}/{actor_id}', get_degrees_to_hub),
+        Route('/actor/search/{search_term}', get_actor_list),
+        Route('/actor/random/{cache_buster}', get_random_actor),
+        Route('/actor/{tmdb_id}', get_actor_info),
+        Route('/graph/totals', get_graph_totals),
+        Route('/metrics', get_metrics),
+        Route('/', default),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*']), Middleware(RequestTiming)],
+    on_shutdown=[shutdown],
+)
@@ -1,11 +1,129 @@
 import os
+import io
 import re
 import csv
+import gzip
+import shutil
+from collections import deque
+from multiprocessing import Pool
+
+NULL = '\\N'
+NULL_VALUES = frozenset(['', NULL])
+TITLE_TYPES = {'movie': 'movie', 'tvMovie': 'movie', 'tvSeries': 'series', 'tvMiniSeries': 'series', 'tvEpisode': 'episode'}
+EXCLUDED_GENRES = frozenset(['Documentary', 'News', 'Game-Show', 'Talk-Show', 'Reality-TV', 'Adult'])
+ACTOR_PROFESSIONS = frozenset(['actor', 'actress'])
+ROLE_SEPARATOR = re.compile(r',(?<!\\)(?=")')
+# integer id columns written with numeric_ids, each holding the digits of the imdb id column it names
+NUMERIC_ID_COLUMNS = {'title_num': 'title_id', 'name_num': 'name_id',
+                      'episode_title_num': 'episode_id', 'series_title_num': 'series_id'}
+# neo4j-admin import form of each batch file: nodes or relationships, the labels or type given on the
+# command line, and the import header name of each batch column; names and titles are separate id spaces
+IMPORT_FILES = {
+    'movie_batch.tsv': ('nodes', 'Movie:Production', {'title_id': 'title_id:ID(Title)', 'title': 'title', 'year': 'year:int',
+                                                      'title_num': 'title_num:long'}),
+    'episode_batch.tsv': ('nodes', 'Episode:Production', {'title_id': 'title_id:ID(Title)', 'title': 'title', 'year': 'year:int',
+                                                          'title_num': 'title_num:long'}),
+    'series_batch.tsv': ('nodes', 'Series', {'title_id': 'title_id:ID(Title)', 'title': 'title',
+                                             'start_year': 'start_year:int', 'end_year': 'end_year:int',
+                                             'title_num': 'title_num:long'}),
+    'actor_batch.tsv': ('nodes', 'Actor:Person', {'name_id': 'name_id:ID(Name)', 'name': 'name',
+                                                  'birth_year': 'birth_year:int', 'death_year': 'death_year:int',
+                                                  'name_num': 'name_num:long'}),
+    'actor_relation_batch.tsv': ('relationships', 'ACTED_IN', {'title_id': ':END_ID(Title)', 'name_id': ':START_ID(Name)', 'roles': 'roles',
+                                                               'title_num': ':IGNORE', 'name_num': ':IGNORE'}),
+    # the importer cannot set properties on the episode from a relationship file, so the numbers are
+    # kept on EPISODE_OF and moved to the episode after the import (ActorGraph.copy_episode_numbers)
+    'episode_relation_batch.tsv': ('relationships', 'EPISODE_OF', {'episode_id': ':START_ID(Title)', 'series_id': ':END_ID(Title)',
+                                                                   'season_num': 'season_num:int', 'episode_num': 'episode_num:int',
+                                                                   'episode_title_num': ':IGNORE', 'series_title_num': ':IGNORE'}),
+}
+
+# known ids of the node outputs in a pool worker, set once per worker by the pool initializer
+_worker_known_ids = None
+
+
+def _set_worker_known_ids(known_ids):
+    global _worker_known_ids
+    _worker_known_ids = known_ids
+
+
+class IdSet:
+    # imdb ids packed as one bit per id number, so every title or name id fits in a few MB
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, imdb_id):
+        number = int(imdb_id[2:])
+        index = number >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index - len(self.bits) + 1024 * 1024))
+        self.bits[index] |= 1 << (number & 7)
+
+    def __contains__(self, imdb_id):
+        try:
+            number = int(imdb_id[2:])
+        except ValueError:
+            return False
+        index = number >> 3
+        return index < len(self.bits) and self.bits[index] >> (number & 7) & 1 == 1
+
+
+def imdb_id_digits(imdb_id):
+    return imdb_id[2:].lstrip('0') or '0'
+
+
+class NumericIdWriter:
+    # wraps an output writer to append the NUMERIC_ID_COLUMNS of every row, rows are dicts for the dict
+    # engine and sequences (extended in fieldnames order) for the fast engine
+    def __init__(self, writer, fieldnames, dict_rows):
+        self.writer = writer
+        self.dict_rows = dict_rows
+        numeric = [f for f in fieldnames if f in NUMERIC_ID_COLUMNS]
+        if dict_rows:
+            self.columns = [(f, NUMERIC_ID_COLUMNS[f]) for f in numeric]
+        else:
+            self.columns = [fieldnames.index(NUMERIC_ID_COLUMNS[f]) for f in numeric]
+
+    def writerow(self, row):
+        if self.dict_rows:
+            for numeric, column in self.columns:
+                row[numeric] = imdb_id_digits(row[column])
+            self.writer.writerow(row)
+        else:
+            self.writer.writerow((*row, *[imdb_id_digits(row[i]) for i in self.columns]))
+
 
 class BatchConverter:
-    def __init__(self, input_dir, output_dir):
+    def __init__(self, input_dir, output_dir, workers=1, chunk_size=64*1024*1024, engine='fast', prune=True,
+                 numeric_ids=False):
         self.input_dir = os.path.abspath(input_dir)+'/'
         self.output_dir = os.path.abspath(output_dir)+'/'
+        # 'fast' converts positional tuples with precomputed column indexes, 'dict' is the original
+        # DictReader/DictWriter implementation kept for comparison, both write identical files
+        if engine not in ('fast', 'dict'):
+            raise ValueError(f'unknown conversion engine: {engine}')
+        self.engine = engine
+        # with more than one worker title.basics and title.principals are split into chunks of about
+        # chunk_size bytes that are converted in a process pool and concatenated in input order
+        self.workers = workers
+        self.chunk_size = chunk_size
+        # roles and episode links are only written when both ends are in the node outputs written
+        # before them, the ids are read back from those outputs the first time they are needed
+        self.prune = prune
+        self.__known_ids = {}
+        # numeric_ids adds the digits of every imdb id as an integer column next to it, for graphs that
+        # key their nodes by number (see ActorGraph numeric_ids)
+        self.numeric_ids = numeric_ids
+
+    def __getstate__(self):
+        # the id sets are sent to each pool worker once through the pool initializer, not with every chunk
+        state = self.__dict__.copy()
+        state['_BatchConverter__known_ids'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__known_ids = _worker_known_ids
 
     def __enter__(self):
         return self
@@ -13,8 +131,218 @@ class BatchConverter:
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
 
-    def __remove_duplicate_rows(self, filename):
-        os.system(f'sort -u -o {filename} {filename}')
+    def __input_path(self, tsv_file):
+        # imdb files are read straight from the downloaded .gz when there is no decompressed copy
+        tsv_file = self.input_dir + tsv_file
+        if not tsv_file.endswith('.gz') and not os.path.exists(tsv_file) and os.path.exists(tsv_file + '.gz'):
+            tsv_file += '.gz'
+        return tsv_file
+
+    def __open_input(self, tsv_file):
+        tsv_file = self.__input_path(tsv_file)
+        if tsv_file.endswith('.gz'):
+            return gzip.open(tsv_file, 'rt', newline='', encoding='utf-8')
+        return open(tsv_file, newline='', encoding='utf-8')
+
+    def __read_header(self, tsv_file):
+        with self.__open_input(tsv_file) as input_fh:
+            return input_fh.readline().rstrip('\r\n').split('\t')
+
+    def __chunks(self, tsv_file):
+        # chunks end where the leading id changes, so rows sharing an id (and their duplicates) are
+        # always converted by the same worker; plain files are split by byte ranges that the workers
+        # read themselves, a gzip stream can only be read sequentially so its text is passed along
+        path = self.__input_path(tsv_file)
+        if path.endswith('.gz'):
+            with self.__open_input(tsv_file) as input_fh:
+                input_fh.readline()
+                lines = []
+                size = 0
+                for line in input_fh:
+                    if size >= self.chunk_size and line.split('\t', 1)[0] != lines[-1].split('\t', 1)[0]:
+                        yield ('text', ''.join(lines))
+                        lines = []
+                        size = 0
+                    lines.append(line)
+                    size += len(line)
+                if lines:
+                    yield ('text', ''.join(lines))
+            return
+        file_size = os.path.getsize(path)
+        with open(path, 'rb') as input_fh:
+            input_fh.readline()
+            start = input_fh.tell()
+            while start < file_size:
+                end = self.__chunk_end(input_fh, start + self.chunk_size, file_size)
+                yield ('range', path, start, end)
+                start = end
+
+    def __chunk_end(self, input_fh, offset, file_size):
+        if offset >= file_size:
+            return file_size
+        input_fh.seek(offset)
+        input_fh.readline()
+        line = input_fh.readline()
+        if not line:
+            return file_size
+        key = line.split(b'\t', 1)[0]
+        while True:
+            position = input_fh.tell()
+            line = input_fh.readline()
+            if not line:
+                return file_size
+            if line.split(b'\t', 1)[0] != key:
+                return position
+
+    def __output_writer(self, output_fh, fieldnames):
+        if self.engine == 'dict':
+            return csv.DictWriter(output_fh, fieldnames=fieldnames, delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='"')
+        return csv.writer(output_fh, delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='"')
+
+    def __row_writer(self, writer, fieldnames):
+        if any(f in NUMERIC_ID_COLUMNS for f in fieldnames):
+            return NumericIdWriter(writer, fieldnames, self.engine == 'dict')
+        return writer
+
+    def __output_fields(self, outputs):
+        if not self.numeric_ids:
+            return outputs
+        return [(output_file, fieldnames + [n for n, c in NUMERIC_ID_COLUMNS.items() if c in fieldnames])
+                for output_file, fieldnames in outputs]
+
+    def __reader(self, input_fh, header, reader_options):
+        if self.engine == 'dict':
+            return csv.DictReader(input_fh, fieldnames=header, delimiter='\t', **reader_options)
+        return csv.reader(input_fh, delimiter='\t', **reader_options)
+
+    def __row_converter(self, kind):
+        if self.engine == 'dict':
+            return {'title_basics': self.__write_title_basics,
+                    'title_episode': self.__write_title_episode,
+                    'name_basics': self.__write_name_basics,
+                    'title_principals': self.__write_title_principals}[kind]
+        return {'title_basics': self.__fast_title_basics,
+                'title_episode': self.__fast_title_episode,
+                'name_basics': self.__fast_name_basics,
+                'title_principals': self.__fast_title_principals}[kind]
+
+    def __convert(self, kind, tsv_file, reader_options, outputs, parallel=False):
+        # returns the number of rows pruned for an unknown endpoint
+        outputs = self.__output_fields(outputs)
+        if parallel and self.workers > 1:
+            return self.__convert_parallel(kind, tsv_file, reader_options, outputs)
+        output_fhs = [open(output_file, 'w', newline='') for output_file, fieldnames in outputs]
+        try:
+            with self.__open_input(tsv_file) as input_fh:
+                header = input_fh.readline().rstrip('\r\n').split('\t')
+                writers = []
+                for output_fh, (output_file, fieldnames) in zip(output_fhs, outputs):
+                    writer = self.__output_writer(output_fh, fieldnames)
+                    self.__write_header(writer, fieldnames)
+                    writers.append(self.__row_writer(writer, fieldnames))
+                return self.__row_converter(kind)(self.__reader(input_fh, header, reader_options), header, *writers) or 0
+        finally:
+            for output_fh in output_fhs:
+                output_fh.close()
+
+    def __write_header(self, writer, fieldnames):
+        if self.engine == 'dict':
+            writer.writeheader()
+        else:
+            writer.writerow(fieldnames)
+
+    def _convert_chunk(self, task):
+        # runs in a pool worker; single underscore because pickling a bound method looks it up by its
+        # unmangled name
+        kind, header, reader_options, outputs, index, chunk = task
+        if chunk[0] == 'range':
+            path, start, end = chunk[1:]
+            with open(path, 'rb') as input_fh:
+                input_fh.seek(start)
+                text = input_fh.read(end - start).decode('utf-8')
+        else:
+            text = chunk[1]
+        reader = self.__reader(io.StringIO(text, newline=''), header, reader_options)
+        part_files = [f'{output_file}.part{index}' for output_file, fieldnames in outputs]
+        output_fhs = [open(part_file, 'w', newline='') for part_file in part_files]
+        try:
+            writers = [self.__row_writer(self.__output_writer(output_fh, fieldnames), fieldnames)
+                       for output_fh, (output_file, fieldnames) in zip(output_fhs, outputs)]
+            pruned = self.__row_converter(kind)(reader, header, *writers) or 0
+        finally:
+            for output_fh in output_fhs:
+                output_fh.close()
+        return part_files, pruned
+
+    def __convert_parallel(self, kind, tsv_file, reader_options, outputs):
+        header = self.__read_header(tsv_file)
+        output_fhs = [open(output_file, 'w', newline='') for output_file, fieldnames in outputs]
+        pruned = 0
+        try:
+            for output_fh, (output_file, fieldnames) in zip(output_fhs, outputs):
+                self.__write_header(self.__output_writer(output_fh, fieldnames), fieldnames)
+                output_fh.flush()
+            with Pool(self.workers, initializer=_set_worker_known_ids, initargs=(self.__known_ids,)) as pool:
+                # at most two chunks per worker are in flight, which bounds memory when chunks carry text
+                pending = deque()
+                for index, chunk in enumerate(self.__chunks(tsv_file)):
+                    pending.append(pool.apply_async(self._convert_chunk, ((kind, header, reader_options, outputs, index, chunk),)))
+                    if len(pending) >= self.workers * 2:
+                        pruned += self.__append_parts(output_fhs, pending.popleft().get())
+                while pending:
+                    pruned += self.__append_parts(output_fhs, pending.popleft().get())
+        finally:
+            for output_fh in output_fhs:
+                output_fh.close()
+        return pruned
+
+    def __append_parts(self, output_fhs, chunk_result):
+        part_files, pruned = chunk_result
+        for output_fh, part_file in zip(output_fhs, part_files):
+            with open(part_file, newline='') as part_fh:
+                shutil.copyfileobj(part_fh, output_fh)
+            os.remove(part_file)
+        return pruned
+
+    def __load_known_ids(self, *kinds):
+        # reads the ids of the node outputs back into IdSets, an output that does not exist (yet) means
+        # nothing is pruned
+        batch_files = {'productions': ['movie_batch.tsv', 'episode_batch.tsv'],
+                       'episodes': ['episode_batch.tsv'],
+                       'series': ['series_batch.tsv'],
+                       'actors': ['actor_batch.tsv']}
+        for kind in kinds:
+            if kind in self.__known_ids:
+                continue
+            paths = [self.output_dir + f for f in batch_files[kind]]
+            if not self.prune or not all(os.path.exists(path) for path in paths):
+                self.__known_ids[kind] = None
+                continue
+            ids = IdSet()
+            for path in paths:
+                with open(path, newline='', encoding='utf-8') as batch_fh:
+                    batch_fh.readline()
+                    for line in batch_fh:
+                        ids.add(line[:line.index('\t')])
+            self.__known_ids[kind] = ids
+
+    def __has_known_ids(self, *kinds):
+        return all(self.__known_ids.get(kind) is not None for kind in kinds)
+
+    def __unique_rows(self, reader, key_fields):
+        # imdb files are ordered by their leading id, so duplicates can only occur within a run of rows
+        # sharing that id and only the keys of the current run have to be remembered
+        current_id = None
+        seen = set()
+        for row in reader:
+            key = tuple(row[f] for f in key_fields)
+            if key[0] != current_id:
+                current_id = key[0]
+                seen.clear()
+            if key in seen:
+                continue
+            seen.add(key)
+            yield row
 
     def __get_title_type(self, t_type):
         if t_type in ['movie', 'tvMovie']:
@@ -45,99 +373,239 @@ class BatchConverter:
         return prop
 
     def convert_title_basics(self, tsv_file):
-        tsv_file = self.input_dir+tsv_file
-        self.__remove_duplicate_rows(tsv_file)
-        movie_file = self.output_dir+'movie_batch.tsv'
-        series_file = self.output_dir+'series_batch.tsv'
-        episode_file = self.output_dir+'episode_batch.tsv'
-        with open(tsv_file, newline='') as input_fh,\
-             open(movie_file, 'w', newline='') as movie_fh,\
-             open(series_file, 'w', newline='') as series_fh,\
-             open(episode_file, 'w', newline='') as episode_fh:
-
-            reader = csv.DictReader(input_fh, delimiter='\t')
-            movie_writer = csv.DictWriter(movie_fh, fieldnames=['title_id', 'title', 'year'], delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='"')
-            movie_writer.writeheader()
-            series_writer = csv.DictWriter(series_fh, fieldnames=['title_id', 'title', 'start_year', 'end_year'], delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='"')
-            series_writer.writeheader()
-            episode_writer = csv.DictWriter(episode_fh, fieldnames=['title_id', 'title', 'year'], delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='"')
-            episode_writer.writeheader()
-
-            for row in reader:
-                if not self.__genre_is_excluded(row['genres']):
-                    title_type = self.__get_title_type(row['titleType'])
-                    if title_type == 'movie':
-                        if not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['primaryTitle']):
-                            movie_props = {'title_id': row['tconst'],
-                                           'title': row['primaryTitle'],
-                                           'year': self.__convert_null_property(row['startYear'])}
-                            movie_writer.writerow(movie_props)
-                    if title_type == 'series':
-                        if not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['primaryTitle']):
-                            series_props = {'title_id': row['tconst'],
-                                            'title': row['primaryTitle'],
-                                            'start_year': self.__convert_null_property(row['startYear']),
-                                            'end_year': self.__convert_null_property(row['endYear'])}
-                            series_writer.writerow(series_props)
-                    if title_type == 'episode':
-                        if not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['primaryTitle']):
-                            episode_props = {'title_id': row['tconst'],
-                                             'title': row['primaryTitle'],
-                                             'year': self.__convert_null_property(row['startYear'])}
-                            episode_writer.writerow(episode_props)
+        self.__known_ids = {}
+        outputs = [(self.output_dir+'movie_batch.tsv', ['title_id', 'title', 'year']),
+                   (self.output_dir+'series_batch.tsv', ['title_id', 'title', 'start_year', 'end_year']),
+                   (self.output_dir+'episode_batch.tsv', ['title_id', 'title', 'year'])]
+        self.__convert('title_basics', tsv_file, {}, outputs, parallel=True)
+
+    # the link conversions return how many rows were pruned because an end is not in the node outputs
 
     def convert_title_episode(self, tsv_file):
-        tsv_file = self.input_dir + tsv_file
-        self.__remove_duplicate_rows(tsv_file)
-        episode_file = self.output_dir + 'episode_relation_batch.tsv'
-        with open(tsv_file, newline='') as input_fh, open(episode_file, 'w', newline='') as episode_fh:
-            reader = csv.DictReader(input_fh, delimiter='\t')
-            episode_writer = csv.DictWriter(episode_fh, fieldnames=['episode_id', 'series_id', 'season_num', 'episode_num'], delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='"')
-            episode_writer.writeheader()
-
-            for row in reader:
-                if not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['parentTconst']):
-                    episode_props = {'episode_id': row['tconst'],
-                                     'series_id': row['parentTconst'],
-                                     'season_num': self.__convert_null_property(row['seasonNumber']),
-                                     'episode_num': self.__convert_null_property(row['episodeNumber'])}
-                    episode_writer.writerow(episode_props)
+        self.__load_known_ids('episodes', 'series')
+        outputs = [(self.output_dir + 'episode_relation_batch.tsv', ['episode_id', 'series_id', 'season_num', 'episode_num'])]
+        return self.__convert('title_episode', tsv_file, {}, outputs)
 
     def convert_name_basics(self, tsv_file):
-        tsv_file = self.input_dir + tsv_file
-        self.__remove_duplicate_rows(tsv_file)
-        actor_file = self.output_dir + 'actor_batch.tsv'
-        with open(tsv_file, newline='') as input_fh, open(actor_file, 'w', newline='') as actor_fh:
-            reader = csv.DictReader(input_fh, delimiter='\t')
-            actor_writer = csv.DictWriter(actor_fh, ['name_id', 'name', 'birth_year', 'death_year'], delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='"')
-            actor_writer.writeheader()
-
-            for row in reader:
-                professions = row['primaryProfession'].split(',')
-                if ('actor' in professions or 'actress' in professions) and \
-                        (not self.__required_property_is_null(row['nconst']) and not self.__required_property_is_null(row['primaryName'])):
-                    actor_props = {'name_id': row['nconst'],
-                                   'name': row['primaryName'],
-                                   'birth_year': self.__convert_null_property(row['birthYear']),
-                                   'death_year': self.__convert_null_property(row['deathYear'])}
-                    actor_writer.writerow(actor_props)
+        self.__known_ids.pop('actors', None)
+        outputs = [(self.output_dir + 'actor_batch.tsv', ['name_id', 'name', 'birth_year', 'death_year'])]
+        self.__convert('name_basics', tsv_file, {}, outputs)
 
     def convert_title_principals(self, tsv_file):
-        tsv_file = self.input_dir + tsv_file
-        self.__remove_duplicate_rows(tsv_file)
-        role_file = self.output_dir + 'actor_relation_batch.tsv'
-        with open(tsv_file, newline='') as input_fh, open(role_file, 'w', newline='') as role_fh:
-            reader = csv.DictReader(input_fh, delimiter='\t', quoting=csv.QUOTE_NONE)
-            role_writer = csv.DictWriter(role_fh, ['title_id', 'name_id', 'roles'], delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='"')
-            role_writer.writeheader()
-
-            for row in reader:
-                if (row['category'] in ['actor', 'actress']) and \
-                        (not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['nconst'])):
-                    roles = self.__convert_null_property(row['characters'])
-                    if roles is not None:
-                        roles = ','.join([r.strip('"') for r in re.split(r',(?<!\\)(?=")', roles.strip('[]').replace('\\"', '"'))])
-                    role_props = {'title_id': row['tconst'],
-                                  'name_id': row['nconst'],
-                                  'roles': roles}
-                    role_writer.writerow(role_props)
+        self.__load_known_ids('productions', 'actors')
+        outputs = [(self.output_dir + 'actor_relation_batch.tsv', ['title_id', 'name_id', 'roles'])]
+        return self.__convert('title_principals', tsv_file, {'quoting': csv.QUOTE_NONE}, outputs, parallel=True)
+
+    def write_import_files(self, import_dir):
+        # writes a neo4j-admin import header file and a headerless copy of every batch file to import_dir
+        # and returns the --nodes and --relationships arguments naming them
+        import_dir = os.path.abspath(import_dir)+'/'
+        os.makedirs(import_dir, exist_ok=True)
+        arguments = []
+        for batch_file, (kind, labels, columns) in IMPORT_FILES.items():
+            header_file = import_dir + batch_file.replace('.tsv', '_header.tsv')
+            data_file = import_dir + batch_file
+            with open(self.output_dir + batch_file, 'rb') as batch_fh, open(data_file, 'wb') as data_fh:
+                header = batch_fh.readline().decode('utf-8').rstrip('\r\n').split('\t')
+                if not set(header) <= set(columns):
+                    raise ValueError(f'{batch_file} has columns {header}, expected {list(columns)}')
+                shutil.copyfileobj(batch_fh, data_fh)
+            with open(header_file, 'w', newline='') as header_fh:
+                header_fh.write('\t'.join(columns[c] for c in header) + '\n')
+            arguments.append(f'--{kind}={labels}={header_file},{data_file}')
+        return arguments
+
+    # dict engine
+
+    def __write_title_basics(self, reader, header, movie_writer, series_writer, episode_writer):
+        for row in self.__unique_rows(reader, ['tconst']):
+            if not self.__genre_is_excluded(row['genres']):
+                title_type = self.__get_title_type(row['titleType'])
+                if title_type == 'movie':
+                    if not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['primaryTitle']):
+                        movie_props = {'title_id': row['tconst'],
+                                       'title': row['primaryTitle'],
+                                       'year': self.__convert_null_property(row['startYear'])}
+                        movie_writer.writerow(movie_props)
+                if title_type == 'series':
+                    if not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['primaryTitle']):
+                        series_props = {'title_id': row['tconst'],
+                                        'title': row['primaryTitle'],
+                                        'start_year': self.__convert_null_property(row['startYear']),
+                                        'end_year': self.__convert_null_property(row['endYear'])}
+                        series_writer.writerow(series_props)
+                if title_type == 'episode':
+                    if not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['primaryTitle']):
+                        episode_props = {'title_id': row['tconst'],
+                                         'title': row['primaryTitle'],
+                                         'year': self.__convert_null_property(row['startYear'])}
+                        episode_writer.writerow(episode_props)
+
+    def __write_title_episode(self, reader, header, episode_writer):
+        prune = self.__has_known_ids('episodes', 'series')
+        pruned = 0
+        for row in self.__unique_rows(reader, ['tconst']):
+            if not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['parentTconst']):
+                if prune and (row['tconst'] not in self.__known_ids['episodes'] or row['parentTconst'] not in self.__known_ids['series']):
+                    pruned += 1
+                    continue
+                episode_props = {'episode_id': row['tconst'],
+                                 'series_id': row['parentTconst'],
+                                 'season_num': self.__convert_null_property(row['seasonNumber']),
+                                 'episode_num': self.__convert_null_property(row['episodeNumber'])}
+                episode_writer.writerow(episode_props)
+        return pruned
+
+    def __write_name_basics(self, reader, header, actor_writer):
+        for row in self.__unique_rows(reader, ['nconst']):
+            professions = row['primaryProfession'].split(',')
+            if ('actor' in professions or 'actress' in professions) and \
+                    (not self.__required_property_is_null(row['nconst']) and not self.__required_property_is_null(row['primaryName'])):
+                actor_props = {'name_id': row['nconst'],
+                               'name': row['primaryName'],
+                               'birth_year': self.__convert_null_property(row['birthYear']),
+                               'death_year': self.__convert_null_property(row['deathYear'])}
+                actor_writer.writerow(actor_props)
+
+    def __write_title_principals(self, reader, header, role_writer):
+        # an actor can be listed under several categories for one title, so only acting rows are deduplicated
+        prune = self.__has_known_ids('productions', 'actors')
+        pruned = 0
+        acting_rows = (row for row in reader if row['category'] in ['actor', 'actress'])
+        for row in self.__unique_rows(acting_rows, ['tconst', 'nconst']):
+            if (row['category'] in ['actor', 'actress']) and \
+                    (not self.__required_property_is_null(row['tconst']) and not self.__required_property_is_null(row['nconst'])):
+                if prune and (row['tconst'] not in self.__known_ids['productions'] or row['nconst'] not in self.__known_ids['actors']):
+                    pruned += 1
+                    continue
+                roles = self.__convert_null_property(row['characters'])
+                if roles is not None:
+                    roles = ','.join([r.strip('"') for r in re.split(r',(?<!\\)(?=")', roles.strip('[]').replace('\\"', '"'))])
+                role_props = {'title_id': row['tconst'],
+                              'name_id': row['nconst'],
+                              'roles': roles}
+                role_writer.writerow(role_props)
+        return pruned
+
+    # fast engine, rows are lists indexed by the header positions; the leading id of every input is the
+    # dedup key (or its first part), so duplicates are skipped by comparing against the previous row
+
+    def __fast_title_basics(self, reader, header, movie_writer, series_writer, episode_writer):
+        tconst_i, type_i, title_i, start_i, end_i, genres_i = [header.index(c) for c in
+            ('tconst', 'titleType', 'primaryTitle', 'startYear', 'endYear', 'genres')]
+        width = len(header)
+        write_movie = movie_writer.writerow
+        write_series = series_writer.writerow
+        write_episode = episode_writer.writerow
+        previous_id = None
+        for row in reader:
+            if len(row) < width:
+                continue
+            tconst = row[tconst_i]
+            if tconst == previous_id:
+                continue
+            previous_id = tconst
+            title_type = TITLE_TYPES.get(row[type_i])
+            if title_type is None or not EXCLUDED_GENRES.isdisjoint(row[genres_i].split(',')):
+                continue
+            title = row[title_i]
+            if tconst in NULL_VALUES or title in NULL_VALUES:
+                continue
+            start_year = row[start_i]
+            if start_year == NULL:
+                start_year = None
+            if title_type == 'movie':
+                write_movie((tconst, title, start_year))
+            elif title_type == 'series':
+                end_year = row[end_i]
+                write_series((tconst, title, start_year, None if end_year == NULL else end_year))
+            else:
+                write_episode((tconst, title, start_year))
+
+    def __fast_title_episode(self, reader, header, episode_writer):
+        tconst_i, parent_i, season_i, episode_i = [header.index(c) for c in
+            ('tconst', 'parentTconst', 'seasonNumber', 'episodeNumber')]
+        width = len(header)
+        write_episode = episode_writer.writerow
+        prune = self.__has_known_ids('episodes', 'series')
+        if prune:
+            known_episodes = self.__known_ids['episodes']
+            known_series = self.__known_ids['series']
+        pruned = 0
+        previous_id = None
+        for row in reader:
+            if len(row) < width:
+                continue
+            tconst = row[tconst_i]
+            if tconst == previous_id:
+                continue
+            previous_id = tconst
+            parent = row[parent_i]
+            if tconst in NULL_VALUES or parent in NULL_VALUES:
+                continue
+            if prune and (tconst not in known_episodes or parent not in known_series):
+                pruned += 1
+                continue
+            season = row[season_i]
+            episode = row[episode_i]
+            write_episode((tconst, parent, None if season == NULL else season, None if episode == NULL else episode))
+        return pruned
+
+    def __fast_name_basics(self, reader, header, actor_writer):
+        nconst_i, name_i, birth_i, death_i, profession_i = [header.index(c) for c in
+            ('nconst', 'primaryName', 'birthYear', 'deathYear', 'primaryProfession')]
+        width = len(header)
+        write_actor = actor_writer.writerow
+        previous_id = None
+        for row in reader:
+            if len(row) < width:
+                continue
+            nconst = row[nconst_i]
+            if nconst == previous_id:
+                continue
+            previous_id = nconst
+            if ACTOR_PROFESSIONS.isdisjoint(row[profession_i].split(',')):
+                continue
+            name = row[name_i]
+            if nconst in NULL_VALUES or name in NULL_VALUES:
+                continue
+            birth = row[birth_i]
+            death = row[death_i]
+            write_actor((nconst, name, None if birth == NULL else birth, None if death == NULL else death))
+
+    def __fast_title_principals(self, reader, header, role_writer):
+        tconst_i, nconst_i, category_i, characters_i = [header.index(c) for c in
+            ('tconst', 'nconst', 'category', 'characters')]
+        width = len(header)
+        write_role = role_writer.writerow
+        split_roles = ROLE_SEPARATOR.split
+        prune = self.__has_known_ids('productions', 'actors')
+        if prune:
+            known_titles = self.__known_ids['productions']
+            known_actors = self.__known_ids['actors']
+        pruned = 0
+        current_id = None
+        seen = set()
+        for row in reader:
+            if len(row) < width or row[category_i] not in ACTOR_PROFESSIONS:
+                continue
+            tconst = row[tconst_i]
+            nconst = row[nconst_i]
+            if tconst != current_id:
+                current_id = tconst
+                seen.clear()
+            if nconst in seen:
+                continue
+            seen.add(nconst)
+            if tconst in NULL_VALUES or nconst in NULL_VALUES:
+                continue
+            if prune and (tconst not in known_titles or nconst not in known_actors):
+                pruned += 1
+                continue
+            roles = row[characters_i]
+            if roles == NULL:
+                roles = None
+            else:
+                roles = ','.join([r.strip('"') for r in split_roles(roles.strip('[]').replace('\\"', '"'))])
+            write_role((tconst, nconst, roles))
+        return pruned
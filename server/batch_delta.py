@@ -0,0 +1,71 @@
+import os
+import csv
+
+# key columns of each batch file, the first one is the id the file is ordered by
+BATCH_FILE_KEYS = {
+    'actor_batch.tsv': ['name_id'],
+    'movie_batch.tsv': ['title_id'],
+    'series_batch.tsv': ['title_id'],
+    'episode_batch.tsv': ['title_id'],
+    'actor_relation_batch.tsv': ['title_id', 'name_id'],
+    'episode_relation_batch.tsv': ['episode_id'],
+}
+
+
+def _row_groups(filename, key_columns):
+    # yields (id, {key: row}) for each run of rows sharing the leading id, the batch files keep the imdb
+    # order so both snapshots can be merged without loading either into memory. imdb orders by the id
+    # string (nm1000000 < nm10000000 < nm1000001), so ids are compared as strings, not as numbers
+    if not os.path.exists(filename):
+        return
+    with open(filename, newline='', encoding='utf-8') as fh:
+        reader = csv.DictReader(fh, delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='"')
+        group_id = None
+        group = {}
+        for row in reader:
+            lead_id = row[key_columns[0]]
+            if lead_id != group_id:
+                if group_id is not None:
+                    if lead_id < group_id:
+                        raise ValueError(f'{filename} is not ordered by {key_columns[0]}, run a full load instead')
+                    yield group_id, group
+                group_id = lead_id
+                group = {}
+            group[tuple(row[c] for c in key_columns)] = row
+        if group_id is not None:
+            yield group_id, group
+
+
+def diff_batch_file(previous_file, current_file, key_columns):
+    # yields ('upsert', row) for rows that are new or changed in the current file and ('delete', row) for
+    # rows of the previous file whose key is gone, one id group at a time so a delta is never held in memory
+    previous_groups = _row_groups(previous_file, key_columns)
+    current_groups = _row_groups(current_file, key_columns)
+    previous = next(previous_groups, None)
+    current = next(current_groups, None)
+    while previous is not None or current is not None:
+        if current is None or (previous is not None and previous[0] < current[0]):
+            for row in previous[1].values():
+                yield 'delete', row
+            previous = next(previous_groups, None)
+        elif previous is None or current[0] < previous[0]:
+            for row in current[1].values():
+                yield 'upsert', row
+            current = next(current_groups, None)
+        else:
+            for key, row in current[1].items():
+                if previous[1].get(key) != row:
+                    yield 'upsert', row
+            for key, row in previous[1].items():
+                if key not in current[1]:
+                    yield 'delete', row
+            previous = next(previous_groups, None)
+            current = next(current_groups, None)
+
+
+def batch_changes(previous_dir, current_dir, filename, change):
+    # the rows of one kind of change in a batch file; every call merges both files again, which reads
+    # them twice but lets each kind stream straight into its own chunked write
+    rows = diff_batch_file(os.path.join(previous_dir, filename), os.path.join(current_dir, filename),
+                           BATCH_FILE_KEYS[filename])
+    return (row for kind, row in rows if kind == change)
@@ -0,0 +1,56 @@
+from batch_converter import BatchConverter
+import tempfile
+import random
+import time
+import sys
+import os
+
+# conversion throughput (rows/s) of title.principals and title.basics for each conversion engine
+# against the number of workers, on a synthetic fixture shaped like the imdb dataset
+#
+# usage: python benchmark_batch_converter.py [title_count] [workers,...] [engine,...]
+
+title_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+worker_counts = [int(w) for w in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4, 8]
+engines = sys.argv[3].split(',') if len(sys.argv) > 3 else ['dict', 'fast']
+title_types = ['movie', 'tvMovie', 'tvSeries', 'tvMiniSeries', 'tvEpisode', 'short', 'video']
+genres = ['Drama', 'Comedy,Romance', 'Documentary', 'Action,Adventure,Drama', 'News', '\\N']
+categories = ['actor', 'actress', 'actor', 'director', 'writer', 'self', 'producer']
+
+
+def write_fixture(input_dir):
+    random.seed(0)
+    basics_rows = 0
+    principals_rows = 0
+    with open(os.path.join(input_dir, 'title.basics.tsv'), 'w') as f:
+        f.write('tconst\ttitleType\tprimaryTitle\toriginalTitle\tisAdult\tstartYear\tendYear\truntimeMinutes\tgenres\n')
+        for i in range(1, title_count + 1):
+            f.write(f'tt{i:07d}\t{random.choice(title_types)}\tTitle number {i}\tTitle number {i}\t0\t'
+                    f'{random.randint(1900, 2021)}\t\\N\t{random.randint(1, 200)}\t{random.choice(genres)}\n')
+            basics_rows += 1
+    with open(os.path.join(input_dir, 'title.principals.tsv'), 'w') as f:
+        f.write('tconst\tordering\tnconst\tcategory\tjob\tcharacters\n')
+        for i in range(1, title_count + 1):
+            for ordering in range(1, random.randint(2, 11)):
+                characters = f'["Character {ordering}","Other, Character"]' if ordering % 3 else '\\N'
+                f.write(f'tt{i:07d}\t{ordering}\tnm{random.randint(1, title_count * 2):07d}\t'
+                        f'{random.choice(categories)}\t\\N\t{characters}\n')
+                principals_rows += 1
+    return basics_rows, principals_rows
+
+
+with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
+    print('writing fixture ...')
+    basics_rows, principals_rows = write_fixture(input_dir)
+    print(f'title.basics: {basics_rows} rows, title.principals: {principals_rows} rows')
+    for engine in engines:
+        for workers in worker_counts:
+            with BatchConverter(input_dir, output_dir, workers=workers, chunk_size=16*1024*1024, engine=engine) as converter:
+                start = time.perf_counter()
+                converter.convert_title_basics('title.basics.tsv')
+                basics_time = time.perf_counter() - start
+                start = time.perf_counter()
+                converter.convert_title_principals('title.principals.tsv')
+                principals_time = time.perf_counter() - start
+            print(f'{engine:>4} engine, workers {workers:>2}: title.basics {basics_rows / basics_time:>10,.0f} rows/s, '
+                  f'title.principals {principals_rows / principals_time:>10,.0f} rows/s')
@@ -0,0 +1,69 @@
+from actor_graph import ActorGraph
+from connection_engine import AdjacencySnapshot
+from dotenv import load_dotenv
+import statistics
+import random
+import time
+import sys
+import os
+
+# compares the neo4j shortestPath connection with the in-process bidirectional BFS over a batch file
+# snapshot on random actor pairs; the bfs time includes hydrating the path from neo4j, the search alone
+# is reported separately
+#
+# usage: python benchmark_connection_engines.py [pair_count] [max_search_depth] [batch_dir]
+
+load_dotenv()
+db_user = os.getenv('NEO4J_USER')
+db_pass = os.getenv('NEO4J_PASS')
+pair_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+max_search_depth = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+batch_dir = sys.argv[3] if len(sys.argv) > 3 else 'batch_files'
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def summary(label, times):
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    print(f'{label:>12}: median {statistics.median(times):>9.2f} ms, mean {statistics.mean(times):>9.2f} ms, '
+          f'p95 {p95:>9.2f} ms, max {times[-1]:>9.2f} ms')
+
+
+print('building snapshot ...')
+snapshot, build_time = timed(AdjacencySnapshot.from_batch_files, batch_dir)
+print(f'{snapshot.actor_count} actors, {len(snapshot.title_nums)} titles, {len(snapshot.neighbors) // 2} roles '
+      f'in {build_time / 1000:.1f} s')
+
+random.seed(0)
+with ActorGraph(db_user, db_pass) as graph:
+    pairs = []
+    while len(pairs) < pair_count:
+        first, second = graph.get_random_actor(), graph.get_random_actor()
+        if first is None or second is None:
+            sys.exit('no random actors in the graph, run index_random_actors first')
+        pairs.append((first['imdb_id'], second['imdb_id']))
+
+    neo4j_times = []
+    search_times = []
+    bfs_times = []
+    mismatches = 0
+    for first, second in pairs:
+        connection, neo4j_time = timed(graph.get_actor_connection, first, second, max_search_depth)
+        path, search_time = timed(snapshot.shortest_path, first, second, max_search_depth)
+        bfs_connection, hydrate_time = timed(graph.get_connection_of_path, path) if path else ([], 0)
+        neo4j_times.append(neo4j_time)
+        search_times.append(search_time)
+        bfs_times.append(search_time + hydrate_time)
+        # paths can differ where several are equally short, their lengths may not
+        if len(connection or []) != len(bfs_connection or []):
+            mismatches += 1
+
+print(f'{pair_count} pairs, max search depth {max_search_depth}, {mismatches} with different path lengths')
+summary('neo4j', neo4j_times)
+summary('bfs', bfs_times)
+summary('bfs search', search_times)
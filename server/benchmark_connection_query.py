@@ -0,0 +1,52 @@
+from actor_graph import ActorGraph, CONNECTION_QUERIES, connection_depth_bound
+from dotenv import load_dotenv
+import statistics
+import time
+import sys
+import os
+
+# compares query planning time of the old string-interpolated connection query with the
+# parameterized depth-bound templates, using EXPLAIN so only planning is measured
+#
+# usage: python benchmark_connection_query.py [pair_count] [max_search_depth]
+
+load_dotenv()
+db_user = os.getenv('NEO4J_USER')
+db_pass = os.getenv('NEO4J_PASS')
+pair_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+max_search_depth = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+
+
+def interpolated_query(actor_id_1, actor_id_2, depth):
+    return f"""MATCH (a:Actor {{name_id: '{actor_id_1}'}})
+               MATCH (b:Actor {{name_id: '{actor_id_2}'}})
+               MATCH path = shortestPath((a)-[r:ACTED_IN*0..{depth}]-(b))
+               RETURN path,
+                      [x IN RELATIONSHIPS(path) | x.roles] AS roles,
+                      [x IN NODES(path) | LABELS(x)] AS node_type
+            """
+
+
+def explain_time(session, query, params=None):
+    start = time.perf_counter()
+    session.run('EXPLAIN ' + query, params or {}).consume()
+    return (time.perf_counter() - start) * 1000
+
+
+with ActorGraph(db_user, db_pass) as graph:
+    with graph.driver.session() as session:
+        result = session.run('MATCH (a:Actor) RETURN a.name_id AS name_id LIMIT $limit', {'limit': pair_count * 2})
+        actor_ids = [r['name_id'] for r in result]
+        pairs = list(zip(actor_ids[0::2], actor_ids[1::2]))
+        if not pairs:
+            sys.exit('no actors in the graph to benchmark with')
+
+        interpolated_times = [explain_time(session, interpolated_query(a, b, max_search_depth)) for a, b in pairs]
+        parameterized_query = CONNECTION_QUERIES[connection_depth_bound(max_search_depth)]
+        parameterized_times = [explain_time(session, parameterized_query,
+                                            {'actor_id_1': a, 'actor_id_2': b, 'max_search_depth': max_search_depth})
+                               for a, b in pairs]
+
+for label, times in (('interpolated', interpolated_times), ('parameterized', parameterized_times)):
+    print(f'{label:>14}: {len(times)} pairs, median {statistics.median(times):.2f} ms, '
+          f'mean {statistics.mean(times):.2f} ms, max {max(times):.2f} ms')
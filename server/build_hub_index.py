@@ -0,0 +1,31 @@
+from actor_graph import mark_graph_changed
+from connection_engine import AdjacencySnapshot, build_hub_indexes
+from dotenv import load_dotenv
+import sys
+import os
+
+# precomputes the bfs distance and parent arrays of the hub actors, the popular actors most connections
+# are asked for, so a connection to a hub is read by walking the parents instead of searching. the
+# indexes are computed from the connection snapshot and are only used with it: create_batch_files.py
+# rebuilds them along with the snapshot, run this after changing the hub list
+#
+# usage: python build_hub_index.py [hub imdb id ...], defaulting to the HUB_ACTORS list
+
+load_dotenv()
+batch_dir = 'batch_files'
+connection_snapshot_file = os.getenv('CONNECTION_SNAPSHOT_FILE', 'connection_snapshot.bin')
+hub_index_dir = os.getenv('HUB_INDEX_DIR', 'hub_index')
+hub_actors = sys.argv[1:] or [hub_id.strip() for hub_id in os.getenv('HUB_ACTORS', '').split(',') if hub_id.strip()]
+
+if not hub_actors:
+    sys.exit('no hub actors, pass their imdb ids or set HUB_ACTORS')
+if os.path.exists(connection_snapshot_file):
+    snapshot = AdjacencySnapshot.open(connection_snapshot_file)
+else:
+    print('building connection snapshot ...')
+    snapshot = AdjacencySnapshot.from_batch_files(batch_dir)
+    snapshot.write(connection_snapshot_file)
+print('writing hub indexes ...')
+build_hub_indexes(snapshot, hub_actors, hub_index_dir)
+# the web workers load the new indexes on their next version check
+mark_graph_changed()
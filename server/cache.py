@@ -0,0 +1,131 @@
+from collections import OrderedDict
+import threading
+import sqlite3
+import pickle
+import time
+import os
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self.__lock:
+            item = self.__items.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self.__items[key]
+                return default
+            self.__items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self.__lock:
+            self.__items[key] = (value, expires)
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.maxsize:
+                self.__items.popitem(last=False)
+
+    def delete(self, key):
+        with self.__lock:
+            self.__items.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+
+
+class SQLiteCache:
+    # on-disk tier shared by every worker process on the host, expiry uses wall clock time; expired rows
+    # are deleted by the first write of each process after purge_interval seconds
+    def __init__(self, path, ttl=None, purge_interval=600):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.__next_purge = 0
+        self.__connections = {}
+        self.__lock = threading.Lock()
+
+    def __connection(self):
+        # sqlite connections must not cross a fork, so each process opens its own
+        pid = os.getpid()
+        if pid not in self.__connections:
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            self.__connections = {pid: connection}
+        return self.__connections[pid]
+
+    def get(self, key, default=MISSING):
+        return self.get_with_ttl(key, default)[0]
+
+    def get_with_ttl(self, key, default=MISSING):
+        # (value, seconds until it expires or None when it does not)
+        with self.__lock:
+            row = self.__connection().execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is None or (row[1] is not None and row[1] < now):
+            return default, None
+        return pickle.loads(row[0]), None if row[1] is None else row[1] - now
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        with self.__lock:
+            connection = self.__connection()
+            connection.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                               (key, pickle.dumps(value), expires))
+            if now >= self.__next_purge:
+                self.__next_purge = now + self.purge_interval
+                connection.execute('DELETE FROM cache WHERE expires < ?', (now,))
+
+    def delete(self, key):
+        with self.__lock:
+            self.__connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self.__lock:
+            self.__connection().execute('DELETE FROM cache')
+
+
+class TieredCache:
+    # in-process LRU in front of an optional shared tier, hits in the shared tier are copied into memory
+    # for the time they have left in the shared tier
+    def __init__(self, memory, shared=None):
+        self.memory = memory
+        self.shared = shared
+
+    def get(self, key, default=MISSING):
+        value = self.memory.get(key)
+        if value is MISSING and self.shared is not None:
+            value, ttl = self.shared.get_with_ttl(key)
+            if value is not MISSING:
+                self.memory.set(key, value, ttl=ttl)
+        return default if value is MISSING else value
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl=ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, ttl=ttl)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.shared is not None:
+            self.shared.clear()
@@ -0,0 +1,58 @@
+from actor_graph import ActorGraph
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from tmdb_images import get_profile_path, get_poster_path, TMDB_MAX_CONCURRENCY
+import sys
+import os
+import time
+
+# resolves tmdb images for the most connected actors and titles and stores their paths on the graph nodes,
+# so connection responses through them never wait on tmdb ('' is stored when tmdb has no image, along with
+# the time it was looked up; responses look such a miss up again once IMAGE_CACHE_NEGATIVE_TTL has passed)
+#
+# usage: python cache_images.py [actor_limit] [title_limit]
+
+load_dotenv()
+db_user = os.getenv('NEO4J_USER')
+db_pass = os.getenv('NEO4J_PASS')
+actor_limit = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+title_limit = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+batch_size = 500
+
+
+def image_missed_at(path):
+    return None if path else time.time()
+
+
+# a failed lookup is skipped rather than ending the run, the node keeps what it had before and is looked up
+# again on the next run
+def actor_image(actor):
+    try:
+        path = get_profile_path(actor['name'], actor['name_id']) or ''
+        return {'name_id': actor['name_id'], 'profile_path': path, 'image_missed_at': image_missed_at(path)}
+    except Exception as e:
+        print(f'  profile of {actor["name_id"]} skipped: {e}')
+        return None
+
+
+def title_image(title):
+    prod_type = 'movie' if title['type'] == 'movie' else 'series'
+    try:
+        path = get_poster_path(title['title'], title['title_id'], prod_type) or ''
+        return {'title_id': title['title_id'], 'poster_path': path, 'image_missed_at': image_missed_at(path)}
+    except Exception as e:
+        print(f'  poster of {title["title_id"]} skipped: {e}')
+        return None
+
+
+with ActorGraph(db_user, db_pass) as graph, ThreadPoolExecutor(max_workers=TMDB_MAX_CONCURRENCY) as executor:
+    print('caching actor images ...')
+    actors = graph.get_most_connected_actors(actor_limit)
+    for i in range(0, len(actors), batch_size):
+        graph.set_actor_images([row for row in executor.map(actor_image, actors[i:i + batch_size]) if row is not None])
+    print('caching title images ...')
+    titles = graph.get_most_connected_titles(title_limit)
+    for i in range(0, len(titles), batch_size):
+        graph.set_title_images([row for row in executor.map(title_image, titles[i:i + batch_size]) if row is not None])
+
+print('image cache load complete')
@@ -0,0 +1,448 @@
+from array import array
+from bisect import bisect_left
+import threading
+import time
+import json
+import mmap
+import zlib
+import sys
+import os
+
+SNAPSHOT_MAGIC = b'ACSNAP01'
+HUB_MAGIC = b'ACHUB001'
+# typecodes of the snapshot and hub index arrays, fixed width on every platform the server runs on
+SNAPSHOT_ARRAYS = {'actor_nums': 'i', 'title_nums': 'i', 'offsets': 'q', 'neighbors': 'i', 'ids': 'B'}
+HUB_ARRAYS = {'parents': 'i', 'distances': 'H'}
+# hub index distance of the nodes the hub does not reach
+UNREACHED = 0xFFFF
+
+
+def _id_number(imdb_id):
+    return int(imdb_id[2:])
+
+
+def _read_id_numbers(filename):
+    # the leading id numbers of a batch file
+    numbers = array('i')
+    with open(filename, newline='', encoding='utf-8') as batch_fh:
+        batch_fh.readline()
+        for line in batch_fh:
+            numbers.append(int(line[2:line.index('\t')]))
+    return numbers
+
+
+def _sorted_id_numbers(*filenames):
+    # the id numbers of the batch files in numeric order, for the snapshot's bisect lookups; imdb's own
+    # files are ordered by the id string (nm1000000 < nm10000000 < nm1000001), so they are sorted here
+    # rather than trusting the file order, and an id listed twice means the batch files are corrupt
+    numbers = array('i')
+    for filename in filenames:
+        numbers.extend(_read_id_numbers(filename))
+    if any(numbers[i] >= numbers[i + 1] for i in range(len(numbers) - 1)):
+        numbers = array('i', sorted(numbers))
+        for i in range(len(numbers) - 1):
+            if numbers[i] == numbers[i + 1]:
+                raise ValueError(f'id number {numbers[i]} is listed twice in {", ".join(filenames)}')
+    return numbers
+
+
+def _index_of(numbers, number):
+    i = bisect_left(numbers, number)
+    if i < len(numbers) and numbers[i] == number:
+        return i
+    return None
+
+
+def _write_arrays(filename, magic, header, arrays):
+    # one file of fixed-width native arrays behind magic and a json header, so workers can map it
+    # read-only and share its pages; arrays maps each name to (typecode, length, chunks of its bytes).
+    # it is written under a temporary name and renamed, which leaves workers still mapping the previous
+    # file unaffected
+    header = dict(header, byteorder=sys.byteorder, arrays={})
+    position = 0
+    for name, (typecode, length, chunks) in arrays.items():
+        header['arrays'][name] = {'offset': position, 'length': length}
+        position += (length * array(typecode).itemsize + 7) // 8 * 8
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = (len(magic) + 8 + len(header_bytes) + 7) // 8 * 8
+    temp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(temp_filename, 'wb') as array_fh:
+        array_fh.write(magic)
+        array_fh.write(len(header_bytes).to_bytes(8, 'little'))
+        array_fh.write(header_bytes)
+        for name, (typecode, length, chunks) in arrays.items():
+            array_fh.seek(data_start + header['arrays'][name]['offset'])
+            for chunk in chunks:
+                array_fh.write(chunk)
+        array_fh.truncate(data_start + position)
+    os.replace(temp_filename, filename)
+
+
+def _open_arrays(filename, magic, typecodes):
+    # maps a file written by _write_arrays, returns its header and the arrays as views of the shared
+    # read-only mapping
+    with open(filename, 'rb') as array_fh:
+        mapping = mmap.mmap(array_fh.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapping[:len(magic)] != magic:
+        raise ValueError(f'{filename} is not a {magic.decode("ascii")} file')
+    header_start = len(magic) + 8
+    header_length = int.from_bytes(mapping[len(magic):header_start], 'little')
+    header = json.loads(mapping[header_start:header_start + header_length].decode('utf-8'))
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(f'{filename} was written on a {header["byteorder"]} endian machine')
+    data_start = (header_start + header_length + 7) // 8 * 8
+    view = memoryview(mapping)
+    arrays = {}
+    for name, typecode in typecodes.items():
+        offset = data_start + header['arrays'][name]['offset']
+        length = header['arrays'][name]['length']
+        arrays[name] = view[offset:offset + length * array(typecode).itemsize].cast(typecode)
+    return header, arrays
+
+
+class AdjacencySnapshot:
+    # the actor <-> production graph of ACTED_IN in compressed sparse row form: actors are nodes
+    # 0..actor_count-1 and productions (movies and episodes) follow, node i's neighbours are
+    # neighbors[offsets[i]:offsets[i + 1]], and a node's imdb id number is found by its position in the
+    # sorted actor_nums / title_nums arrays
+    def __init__(self, actor_nums, title_nums, offsets, neighbors, ids=None, id_width=0, fingerprint=None):
+        self.actor_nums = actor_nums
+        self.title_nums = title_nums
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.actor_count = len(actor_nums)
+        self.node_count = len(offsets) - 1
+        # optional table of every node's imdb id as id_width bytes, padded with zeros
+        self.ids = ids
+        self.id_width = id_width
+        self.__fingerprint = fingerprint
+
+    @classmethod
+    def from_batch_files(cls, batch_dir):
+        actor_nums = _sorted_id_numbers(os.path.join(batch_dir, 'actor_batch.tsv'))
+        title_nums = _sorted_id_numbers(os.path.join(batch_dir, 'movie_batch.tsv'),
+                                        os.path.join(batch_dir, 'episode_batch.tsv'))
+        actor_count = len(actor_nums)
+        node_count = actor_count + len(title_nums)
+        # first pass keeps both ends of every role and counts the degree of every node
+        actor_ends = array('i')
+        title_ends = array('i')
+        degrees = array('i', [0]) * node_count
+        previous_title = None
+        title_index = None
+        with open(os.path.join(batch_dir, 'actor_relation_batch.tsv'), newline='', encoding='utf-8') as batch_fh:
+            batch_fh.readline()
+            for line in batch_fh:
+                title_id, name_id, rest = line.split('\t', 2)
+                if title_id != previous_title:
+                    previous_title = title_id
+                    title_index = _index_of(title_nums, _id_number(title_id))
+                    if title_index is not None:
+                        title_index += actor_count
+                actor_index = _index_of(actor_nums, _id_number(name_id))
+                if title_index is None or actor_index is None:
+                    continue
+                actor_ends.append(actor_index)
+                title_ends.append(title_index)
+                degrees[actor_index] += 1
+                degrees[title_index] += 1
+        offsets = array('q', [0]) * (node_count + 1)
+        for i in range(node_count):
+            offsets[i + 1] = offsets[i] + degrees[i]
+        # second pass places each role in the neighbour lists of both of its ends
+        neighbors = array('i', [0]) * offsets[node_count]
+        positions = array('q', offsets[:node_count])
+        for actor_index, title_index in zip(actor_ends, title_ends):
+            neighbors[positions[actor_index]] = title_index
+            positions[actor_index] += 1
+            neighbors[positions[title_index]] = actor_index
+            positions[title_index] += 1
+        return cls(actor_nums, title_nums, offsets, neighbors)
+
+    def fingerprint(self):
+        # checksum of the graph structure, hub indexes record it to be used only with the snapshot they
+        # were computed from
+        if self.__fingerprint is None:
+            checksum = 0
+            for values in (self.actor_nums, self.title_nums, self.offsets, self.neighbors):
+                checksum = zlib.crc32(values, checksum)
+            self.__fingerprint = checksum
+        return self.__fingerprint
+
+    def write(self, filename):
+        node_count = self.node_count
+        # both id arrays are sorted, so the last actor and the last title have the longest ids
+        id_width = max((len(self.node_id(node)) for node in (self.actor_count - 1, node_count - 1) if node >= 0), default=0)
+        arrays = {name: (SNAPSHOT_ARRAYS[name], len(values), [array(SNAPSHOT_ARRAYS[name], values).tobytes()])
+                  for name, values in (('actor_nums', self.actor_nums), ('title_nums', self.title_nums),
+                                       ('offsets', self.offsets), ('neighbors', self.neighbors))}
+        arrays['ids'] = ('B', node_count * id_width,
+                         (b''.join(self.node_id(node).encode('ascii').ljust(id_width, b'\0')
+                                   for node in range(start, min(start + 65536, node_count)))
+                          for start in range(0, node_count, 65536)))
+        _write_arrays(filename, SNAPSHOT_MAGIC, {'id_width': id_width, 'fingerprint': self.fingerprint()}, arrays)
+
+    @classmethod
+    def open(cls, filename):
+        header, arrays = _open_arrays(filename, SNAPSHOT_MAGIC, SNAPSHOT_ARRAYS)
+        return cls(arrays['actor_nums'], arrays['title_nums'], arrays['offsets'], arrays['neighbors'],
+                   arrays['ids'], header['id_width'], header.get('fingerprint'))
+
+    def actor_node(self, actor_id):
+        return _index_of(self.actor_nums, _id_number(actor_id))
+
+    def node_id(self, node):
+        if self.ids is not None:
+            return bytes(self.ids[node * self.id_width:(node + 1) * self.id_width]).rstrip(b'\0').decode('ascii')
+        if node < self.actor_count:
+            return f'nm{self.actor_nums[node]:07d}'
+        return f'tt{self.title_nums[node - self.actor_count]:07d}'
+
+    def shortest_path(self, actor_id_1, actor_id_2, max_search_depth):
+        # returns the imdb ids along a shortest path of at most max_search_depth roles, alternating actor
+        # and title ids from actor_id_1 to actor_id_2, [] when there is no such path and None when either
+        # actor is not in the snapshot
+        source = self.actor_node(actor_id_1)
+        target = self.actor_node(actor_id_2)
+        if source is None or target is None:
+            return None
+        if source == target:
+            return [self.node_id(source)]
+        offsets = self.offsets
+        neighbors = self.neighbors
+        parents = ({source: None}, {target: None})
+        frontiers = ([source], [target])
+        depth = 0
+        while frontiers[0] and frontiers[1] and depth < max_search_depth:
+            # the side whose frontier has fewer edges to follow is expanded by one level, the first node
+            # reached that the other side has also reached joins a shortest path
+            side = 0 if sum(offsets[n + 1] - offsets[n] for n in frontiers[0]) <= \
+                sum(offsets[n + 1] - offsets[n] for n in frontiers[1]) else 1
+            own = parents[side]
+            other = parents[1 - side]
+            next_frontier = []
+            meeting = None
+            depth += 1
+            for node in frontiers[side]:
+                for i in range(offsets[node], offsets[node + 1]):
+                    neighbor = neighbors[i]
+                    if neighbor in own:
+                        continue
+                    own[neighbor] = node
+                    if neighbor in other:
+                        meeting = neighbor
+                        break
+                    next_frontier.append(neighbor)
+                if meeting is not None:
+                    break
+            if meeting is not None:
+                path = []
+                node = meeting
+                while node is not None:
+                    path.append(node)
+                    node = parents[0][node]
+                path.reverse()
+                node = parents[1][meeting]
+                while node is not None:
+                    path.append(node)
+                    node = parents[1][node]
+                return [self.node_id(n) for n in path]
+            if side == 0:
+                frontiers = (next_frontier, frontiers[1])
+            else:
+                frontiers = (frontiers[0], next_frontier)
+        return []
+
+
+class HubIndex:
+    # single-source bfs from one hub actor over a snapshot: parents[n] is the next node on a shortest
+    # path from node n to the hub (-1 for the hub itself and for nodes it does not reach) and
+    # distances[n] the number of roles on that path, so a connection to the hub is a walk up the parents
+    def __init__(self, hub_id, parents, distances, fingerprint):
+        self.hub_id = hub_id
+        self.parents = parents
+        self.distances = distances
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, snapshot, hub_id):
+        hub = snapshot.actor_node(hub_id)
+        if hub is None:
+            raise ValueError(f'hub actor {hub_id} is not in the snapshot')
+        offsets = snapshot.offsets
+        neighbors = snapshot.neighbors
+        parents = array('i', [-1]) * snapshot.node_count
+        distances = array('H', [UNREACHED]) * snapshot.node_count
+        distances[hub] = 0
+        frontier = [hub]
+        distance = 0
+        while frontier:
+            # clamped below UNREACHED, no real connection is anywhere near that long
+            distance = min(distance + 1, UNREACHED - 1)
+            next_frontier = []
+            for node in frontier:
+                for i in range(offsets[node], offsets[node + 1]):
+                    neighbor = neighbors[i]
+                    if distances[neighbor] == UNREACHED:
+                        distances[neighbor] = distance
+                        parents[neighbor] = node
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        return cls(hub_id, parents, distances, snapshot.fingerprint())
+
+    def write(self, filename):
+        arrays = {name: (HUB_ARRAYS[name], len(values), [array(HUB_ARRAYS[name], values).tobytes()])
+                  for name, values in (('parents', self.parents), ('distances', self.distances))}
+        _write_arrays(filename, HUB_MAGIC, {'hub_id': self.hub_id, 'fingerprint': self.fingerprint}, arrays)
+
+    @classmethod
+    def open(cls, filename):
+        header, arrays = _open_arrays(filename, HUB_MAGIC, HUB_ARRAYS)
+        return cls(header['hub_id'], arrays['parents'], arrays['distances'], header['fingerprint'])
+
+    def distance(self, snapshot, actor_id):
+        # roles between the actor and the hub, None when the actor is not in the snapshot or not connected
+        node = snapshot.actor_node(actor_id)
+        if node is None or self.distances[node] == UNREACHED:
+            return None
+        return self.distances[node]
+
+    def path(self, snapshot, actor_id, max_search_depth):
+        # the imdb ids from actor_id to the hub in the shortest_path format, [] when they are not
+        # connected within max_search_depth roles and None when the actor is not in the snapshot
+        node = snapshot.actor_node(actor_id)
+        if node is None:
+            return None
+        if self.distances[node] > max_search_depth:
+            return []
+        path = []
+        while node != -1:
+            path.append(snapshot.node_id(node))
+            node = self.parents[node]
+        return path
+
+
+def hub_index_file(hub_dir, hub_id):
+    return os.path.join(hub_dir, f'hub_{hub_id}.bin')
+
+
+def build_hub_indexes(snapshot, hub_ids, hub_dir):
+    # computes and writes the bfs tree of every hub actor, the engine picks them up with the snapshot
+    # they were computed from
+    os.makedirs(hub_dir, exist_ok=True)
+    for hub_id in hub_ids:
+        start = time.perf_counter()
+        try:
+            hub = HubIndex.build(snapshot, hub_id)
+        except ValueError as e:
+            print(f'hub {hub_id} skipped: {e}')
+            continue
+        hub.write(hub_index_file(hub_dir, hub_id))
+        reached = sum(1 for node in range(snapshot.actor_count) if hub.distances[node] != UNREACHED)
+        print(f'hub {hub_id}: {reached} actors reached in {time.perf_counter() - start:.1f}s')
+
+
+class ConnectionEngine:
+    # shortest actor connections answered in process from the snapshot_file written by
+    # create_batch_files.py, mapped by the first search; once version() changes (a load or update
+    # finished) the loaded snapshot keeps answering while the new one is mapped in the background. the
+    # hub indexes in hub_dir (written by build_hub_index.py) are loaded along with the snapshot they were
+    # computed from. the web workers never build a snapshot themselves: without one the engine answers
+    # nothing, so connections come from neo4j, until the version changes
+    def __init__(self, snapshot_file, version=lambda: 0, hub_dir=None):
+        self.snapshot_file = snapshot_file
+        self.version = version
+        self.hub_dir = hub_dir
+        # (snapshot, {hub id: HubIndex}), replaced as a whole on reload
+        self.__loaded = None
+        self.__snapshot_version = None
+        self.__reloading = False
+        self.__lock = threading.Lock()
+
+    def __current(self):
+        # (snapshot, hubs), or None when no snapshot could be mapped for this version
+        version = self.version()
+        if self.__loaded is None:
+            with self.__lock:
+                if self.__loaded is None and version != self.__snapshot_version:
+                    self.__snapshot_version = version
+                    try:
+                        self.__loaded = self.__load()
+                    except (OSError, ValueError) as e:
+                        print(f'connection snapshot unavailable until the graph changes: {e}')
+            return self.__loaded
+        with self.__lock:
+            if version != self.__snapshot_version and not self.__reloading:
+                self.__reloading = True
+                threading.Thread(target=self.__reload, args=(version,), daemon=True).start()
+        return self.__loaded
+
+    def __load(self):
+        if not self.snapshot_file:
+            raise FileNotFoundError('no connection snapshot file configured')
+        snapshot = AdjacencySnapshot.open(self.snapshot_file)
+        return snapshot, self.__load_hubs(snapshot)
+
+    def __load_hubs(self, snapshot):
+        hubs = {}
+        if not self.hub_dir or not os.path.isdir(self.hub_dir):
+            return hubs
+        for filename in sorted(os.listdir(self.hub_dir)):
+            if not filename.startswith('hub_') or not filename.endswith('.bin'):
+                continue
+            try:
+                hub = HubIndex.open(os.path.join(self.hub_dir, filename))
+            except (OSError, ValueError) as e:
+                print(f'hub index {filename} skipped: {e}')
+                continue
+            if hub.fingerprint != snapshot.fingerprint():
+                print(f'hub index {filename} skipped: computed from another snapshot')
+                continue
+            hubs[hub.hub_id] = hub
+        return hubs
+
+    def __reload(self, version):
+        try:
+            self.__loaded = self.__load()
+        except Exception as e:
+            print(f'connection snapshot reload failed: {e}')
+        finally:
+            # a failed reload is not retried until the version changes again
+            self.__snapshot_version = version
+            self.__reloading = False
+
+    def __has_hubs(self):
+        # without hub indexes the snapshot is not loaded for hub lookups at all
+        return bool(self.hub_dir) and os.path.isdir(self.hub_dir)
+
+    def shortest_path(self, actor_id_1, actor_id_2, max_search_depth):
+        # the AdjacencySnapshot.shortest_path result, None without a snapshot
+        loaded = self.__current()
+        if loaded is None:
+            return None
+        return loaded[0].shortest_path(actor_id_1, actor_id_2, max_search_depth)
+
+    def hub_path(self, actor_id_1, actor_id_2, max_search_depth):
+        # the shortest_path result read from a hub index when either actor is a hub, None when neither is
+        # (or the other actor is not in the snapshot) and a search is needed
+        loaded = self.__current() if self.__has_hubs() else None
+        if loaded is None:
+            return None
+        snapshot, hubs = loaded
+        if actor_id_2 in hubs:
+            return hubs[actor_id_2].path(snapshot, actor_id_1, max_search_depth)
+        if actor_id_1 in hubs:
+            path = hubs[actor_id_1].path(snapshot, actor_id_2, max_search_depth)
+            return path[::-1] if path is not None else None
+        return None
+
+    def degrees_to_hub(self, hub_id, actor_id):
+        # (is hub, degrees of separation between the actor and the hub or None when not connected)
+        loaded = self.__current() if self.__has_hubs() else None
+        if loaded is None:
+            return False, None
+        snapshot, hubs = loaded
+        if hub_id not in hubs:
+            return False, None
+        distance = hubs[hub_id].distance(snapshot, actor_id)
+        return True, None if distance is None else distance // 2
@@ -1,10 +1,10 @@
 import os
-import gzip
 import shutil
 import requests
 import sys
 from dotenv import load_dotenv
 from batch_converter import BatchConverter
+from connection_engine import AdjacencySnapshot, build_hub_indexes
 from actor_graph import ActorGraph
 
 #   for neo4j config:
@@ -14,13 +14,21 @@ from actor_graph import ActorGraph
 #   set dbms.memory.pagecache.size=4G
 #   set dbms.security.procedures.unrestricted=apoc.*
 #
-# this script assumes a fresh db
+# load the batch files into a fresh db with load_graph_db.py, or apply only the changes since the
+# previous run to an existing db with update_graph_db.py
 
 load_dotenv()
 db_user = os.getenv('NEO4J_USER')
 db_pass = os.getenv('NEO4J_PASS')
 imdb_dir = 'imdb_files'
 batch_dir = 'batch_files'
+convert_workers = int(os.getenv('CONVERT_WORKERS', os.cpu_count() or 1))
+# also write integer id columns, needed to load a graph that ActorGraph reads with NUMERIC_IDS set
+numeric_ids = os.getenv('NUMERIC_IDS', '').lower() in ('1', 'true', 'yes')
+connection_snapshot_file = os.getenv('CONNECTION_SNAPSHOT_FILE', 'connection_snapshot.bin')
+# comma separated imdb ids of the actors whose connections are precomputed, see build_hub_index.py
+hub_actors = [hub_id.strip() for hub_id in os.getenv('HUB_ACTORS', '').split(',') if hub_id.strip()]
+hub_index_dir = os.getenv('HUB_INDEX_DIR', 'hub_index')
 
 # download imdb tsv files
 # -------------------------------------
@@ -28,7 +36,7 @@ batch_dir = 'batch_files'
 # clean up old files
 if os.path.isdir(imdb_dir):
     print('deleting old imdb files ...')
-    for file in [f for f in os.listdir(imdb_dir) if f.endswith('tsv')]:
+    for file in [f for f in os.listdir(imdb_dir) if f.endswith('tsv') or f.endswith('gz')]:
         os.remove(os.path.join(imdb_dir, file))
 else:
     print('creating imdb dir ...')
@@ -45,33 +53,38 @@ for file in files:
             for chunk in r.iter_content(chunk_size=1048576):
                 f.write(chunk)
 
-# unzip files
-print('decompressing dataset ...')
-for file in files:
-    with gzip.open(os.path.join(imdb_dir, f'{file}.gz'), 'rb') as g:
-        with open(os.path.join(imdb_dir, file), 'wb') as f:
-            shutil.copyfileobj(g, f)
-print('cleaning up zip files ...')
-for file in [f for f in os.listdir(imdb_dir) if f.endswith('gz')]:
-    os.remove(os.path.join(imdb_dir, file))
-
 # convert imdb tsv files to compatible format
 # -------------------------------------
-with BatchConverter(imdb_dir, batch_dir) as converter:
+# the converter streams straight from the downloaded gzip files, nothing is decompressed to disk
+with BatchConverter(imdb_dir, batch_dir, workers=convert_workers, numeric_ids=numeric_ids) as converter:
     print('batch convert start')
     if os.path.isdir(converter.output_dir):
-        print('deleting old batch files ...')
-        for file in [f for f in os.listdir(converter.output_dir) if f.endswith('tsv')]:
-            os.remove(os.path.join(converter.output_dir, file))
-    else:
-        print('creating batch dir ...')
-        os.mkdir(converter.output_dir)
+        # the previous conversion is kept so update_graph_db.py can load only what changed
+        print('keeping previous batch files ...')
+        previous_dir = converter.output_dir.rstrip('/') + '_prev'
+        if os.path.isdir(previous_dir):
+            shutil.rmtree(previous_dir)
+        os.rename(converter.output_dir, previous_dir)
+    print('creating batch dir ...')
+    os.mkdir(converter.output_dir)
     print('converting titles ...')
-    converter.convert_title_basics('title.basics.tsv')
+    converter.convert_title_basics('title.basics.tsv.gz')
     print('converting actors ...')
-    converter.convert_name_basics('name.basics.tsv')
+    converter.convert_name_basics('name.basics.tsv.gz')
     print('converting episodes ...')
-    converter.convert_title_episode('title.episode.tsv')
+    pruned = converter.convert_title_episode('title.episode.tsv.gz')
+    print(f'dropped {pruned} episode links to an unknown episode or series')
     print('converting roles ...')
-    converter.convert_title_principals('title.principals.tsv')
+    pruned = converter.convert_title_principals('title.principals.tsv.gz')
+    print(f'dropped {pruned} roles of an unknown actor or title')
     print('batch convert end')
+
+# adjacency snapshot the web workers map for the in-process connection engine, and the hub indexes
+# computed from it; they switch to both once the graph load or update marks the graph as changed
+# -------------------------------------
+print('writing connection snapshot ...')
+snapshot = AdjacencySnapshot.from_batch_files(batch_dir)
+snapshot.write(connection_snapshot_file)
+if hub_actors:
+    print('writing hub indexes ...')
+    build_hub_indexes(snapshot, hub_actors, hub_index_dir)
@@ -1,4 +1,4 @@
-from actor_graph import ActorGraph
+from actor_graph import ActorGraph, mark_graph_changed
 from dotenv import load_dotenv
 import os
 
@@ -10,3 +10,5 @@ db_pass = os.getenv('NEO4J_PASS')
 with ActorGraph(db_user, db_pass) as graph:
     graph.drop_indexes()
     graph.drop_all_nodes()
+
+mark_graph_changed()
@@ -0,0 +1,7 @@
+from actor_graph import close_drivers
+
+wsgi_app = 'wsgi:app'
+
+
+def worker_exit(server, worker):
+    close_drivers()
@@ -0,0 +1,59 @@
+from actor_graph import ActorGraph, mark_graph_changed
+from batch_converter import BatchConverter
+from load_runner import LoadRunner, IMPORT_STAGES
+from neo4j.exceptions import ServiceUnavailable
+from dotenv import load_dotenv
+import subprocess
+import time
+import os
+
+# full rebuild with the offline bulk importer instead of LOAD CSV transactions: the batch files are
+# rewritten in the neo4j-admin import format, neo4j is stopped while the import writes the store, and
+# the indexes and post-load steps run once it is back up. the target database is replaced, so this is
+# only for a complete rebuild; apply later changes with update_graph_db.py
+
+load_dotenv()
+db_user = os.getenv('NEO4J_USER')
+db_pass = os.getenv('NEO4J_PASS')
+imdb_dir = 'imdb_files'
+batch_dir = 'batch_files'
+# neo4j-admin runs as the neo4j user, which needs read access to this directory
+import_dir = os.getenv('IMPORT_FILES_DIR', 'import_files')
+neo4j_admin = os.getenv('NEO4J_ADMIN', 'neo4j-admin')
+database = os.getenv('NEO4J_DATABASE', 'neo4j')
+load_workers = int(os.getenv('LOAD_WORKERS', 4))
+
+
+def wait_for_neo4j(graph, timeout=300):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with graph.driver.session() as session:
+                session.run('RETURN 1').consume()
+            return
+        except ServiceUnavailable:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(2)
+
+
+print('writing import files ...')
+import_arguments = BatchConverter(imdb_dir, batch_dir).write_import_files(import_dir)
+
+print('stopping neo4j ...')
+subprocess.run(['sudo', 'systemctl', 'stop', 'neo4j'], check=True)
+print('importing ...')
+subprocess.run(['sudo', '-u', 'neo4j', neo4j_admin, 'import', f'--database={database}', '--force',
+                '--delimiter=TAB', '--ignore-empty-strings=true', '--skip-duplicate-nodes=true',
+                '--skip-bad-relationships=true', *import_arguments], check=True)
+print('starting neo4j ...')
+subprocess.run(['sudo', 'systemctl', 'start', 'neo4j'], check=True)
+
+with ActorGraph(db_user, db_pass) as graph:
+    wait_for_neo4j(graph)
+    print('db post-import start')
+    LoadRunner(graph, stages=IMPORT_STAGES, max_workers=load_workers).run()
+    print('db post-import end')
+    mark_graph_changed()
+
+print('graph database import complete')
@@ -1,4 +1,5 @@
-from actor_graph import ActorGraph
+from actor_graph import ActorGraph, mark_graph_changed
+from load_runner import LoadRunner
 from dotenv import load_dotenv
 import os
 
@@ -8,24 +9,13 @@ db_user = os.getenv('NEO4J_USER')
 db_pass = os.getenv('NEO4J_PASS')
 imdb_dir = 'imdb_files'
 batch_dir = 'batch_files'
+load_workers = int(os.getenv('LOAD_WORKERS', 4))
 
 with ActorGraph(db_user, db_pass) as graph:
     print('db insert start')
-    print('creating indexes ...')
-    graph.init_indexes()
-    print('creating movies ...')
-    graph.add_movies_from_batch_file(os.path.join(batch_dir, 'movie_batch.tsv'))
-    print('creating episodes ...')
-    graph.add_episodes_from_batch_file(os.path.join(batch_dir, 'episode_batch.tsv'))
-    print('creating series ...')
-    graph.add_series_from_batch_file(os.path.join(batch_dir, 'series_batch.tsv'))
-    print('creating actors ...')
-    graph.add_actors_from_batch_file(os.path.join(batch_dir, 'actor_batch.tsv'))
-    print('creating actor relations ...')
-    graph.add_actor_relations_from_batch_file(os.path.join(batch_dir, 'actor_relation_batch.tsv'))
-    print('creating episode relations ...')
-    graph.add_episode_relations_from_batch_file(os.path.join(batch_dir, 'episode_relation_batch.tsv'))
+    LoadRunner(graph, lambda filename: os.path.join(batch_dir, filename), max_workers=load_workers).run()
     print('db insert end')
+    mark_graph_changed()
     # print('deleting orphan nodes ...')
     # graph.delete_orphans()
 
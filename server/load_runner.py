@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+
+# the stages of a full graph load; 'run' names the ActorGraph method, called with the stage's batch file
+# when it has one, and a stage starts as soon as every stage in 'after' is done, so the node files load
+# concurrently and each relationship file waits for the labels at its two ends. the two relationship
+# files both lock the episode nodes, so running them together deadlocks in their periodic commits and
+# episode relations waits for actor relations. the post-load steps run one after another because they all
+# write to the actor nodes and the graph metadata node
+LOAD_STAGES = [
+    {'name': 'indexes', 'run': 'init_indexes', 'after': []},
+    {'name': 'movies', 'run': 'add_movies_from_batch_file', 'file': 'movie_batch.tsv', 'after': ['indexes']},
+    {'name': 'episodes', 'run': 'add_episodes_from_batch_file', 'file': 'episode_batch.tsv', 'after': ['indexes']},
+    {'name': 'series', 'run': 'add_series_from_batch_file', 'file': 'series_batch.tsv', 'after': ['indexes']},
+    {'name': 'actors', 'run': 'add_actors_from_batch_file', 'file': 'actor_batch.tsv', 'after': ['indexes']},
+    {'name': 'actor relations', 'run': 'add_actor_relations_from_batch_file', 'file': 'actor_relation_batch.tsv',
+     'after': ['movies', 'episodes', 'actors']},
+    {'name': 'episode relations', 'run': 'add_episode_relations_from_batch_file', 'file': 'episode_relation_batch.tsv',
+     'after': ['episodes', 'series', 'actor relations']},
+    {'name': 'actor statistics', 'run': 'compute_actor_stats', 'after': ['episode relations']},
+    {'name': 'random actor index', 'run': 'index_random_actors', 'after': ['actor statistics']},
+    {'name': 'graph totals', 'run': 'store_graph_totals', 'after': ['random actor index']},
+]
+
+# the steps left after neo4j-admin import has written the nodes and relationships
+IMPORT_STAGES = [
+    {'name': 'indexes', 'run': 'init_indexes', 'after': []},
+    {'name': 'episode numbers', 'run': 'copy_episode_numbers', 'after': []},
+    {'name': 'actor statistics', 'run': 'compute_actor_stats', 'after': ['indexes']},
+    {'name': 'random actor index', 'run': 'index_random_actors', 'after': ['actor statistics']},
+    {'name': 'graph totals', 'run': 'store_graph_totals', 'after': ['random actor index']},
+]
+
+
+class LoadRunner:
+    def __init__(self, graph, file_path=lambda filename: filename, stages=LOAD_STAGES, max_workers=4):
+        self.graph = graph
+        self.file_path = file_path
+        self.stages = stages
+        self.max_workers = max_workers
+        names = [stage['name'] for stage in stages]
+        for stage in stages:
+            for dependency in stage['after']:
+                if dependency not in names:
+                    raise ValueError(f"stage {stage['name']} runs after unknown stage {dependency}")
+
+    def __run_stage(self, stage):
+        start = time.perf_counter()
+        method = getattr(self.graph, stage['run'])
+        result = method(self.file_path(stage['file'])) if 'file' in stage else method()
+        rows = result if isinstance(result, int) else None
+        return rows, time.perf_counter() - start
+
+    def __report(self, timings, elapsed):
+        print(f"{'stage':<20} {'seconds':>10} {'rows':>12} {'rows/s':>12}")
+        for name, (rows, seconds) in timings.items():
+            rate = f'{rows / seconds:,.0f}' if rows is not None and seconds > 0 else ''
+            print(f"{name:<20} {seconds:>10.1f} {'' if rows is None else f'{rows:,}':>12} {rate:>12}")
+        print(f"{'total':<20} {elapsed:>10.1f}")
+
+    def run(self):
+        # returns {stage name: (rows, seconds)}; after a failure no new stage is started, the running ones
+        # are left to finish and the first error is raised
+        pending = list(self.stages)
+        done = set()
+        running = {}
+        timings = {}
+        error = None
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='load') as executor:
+            while pending or running:
+                if error is None:
+                    for stage in [s for s in pending if all(d in done for d in s['after'])]:
+                        print(f"{stage['name']} ...")
+                        running[executor.submit(self.__run_stage, stage)] = stage['name']
+                        pending.remove(stage)
+                if not running:
+                    if error is None:
+                        raise ValueError(f"stages {', '.join(s['name'] for s in pending)} depend on each other")
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        timings[name] = future.result()
+                    except Exception as e:
+                        print(f'{name} failed: {e}')
+                        error = error or e
+                        continue
+                    done.add(name)
+                    rows, seconds = timings[name]
+                    print(f"{name} done in {seconds:.1f}s{'' if rows is None else f', {rows:,} rows'}")
+        self.__report(timings, time.perf_counter() - start)
+        if error is not None:
+            raise error
+        return timings
@@ -0,0 +1,201 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from werkzeug.serving import make_server
+import statistics
+import tempfile
+import threading
+import logging
+import multiprocessing
+import socket
+import asyncio
+import json
+import time
+import sys
+import os
+import re
+import httpx
+import uvicorn
+
+# compares one sync flask worker (app.py) with one async worker (async_app.py) under concurrent
+# /actor/connection requests, against local stand-ins: a tmdb http server answering after TMDB_LATENCY
+# seconds (TMDB_BASE_URI points the apps at it) and a graph that answers after NEO4J_LATENCY seconds
+# in place of ActorGraph. every request asks for a different actor pair whose titles and actors are not
+# cached yet, so each one pays for its graph call and its tmdb lookups
+#
+# usage: python load_test_async.py [request_count] [concurrency ...]
+# with LOAD_TEST_SQLITE=1 both apps also get the sqlite tier of the image and connection caches
+
+request_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+concurrency_levels = [int(c) for c in sys.argv[2:]] or [1, 10, 100]
+tmdb_latency = float(os.getenv('TMDB_LATENCY', 0.05))
+neo4j_latency = float(os.getenv('NEO4J_LATENCY', 0.02))
+sqlite_caches = os.getenv('LOAD_TEST_SQLITE', '').lower() in ('1', 'true', 'yes')
+TMDB_PORT = 8765
+FLASK_PORT = 8766
+ASYNC_PORT = 8767
+
+
+class TMDBStandInServer(ThreadingHTTPServer):
+    # the default backlog of 5 would drop connections under the async app's burst of lookups
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class TMDBStandIn(BaseHTTPRequestHandler):
+    # answers the tmdb requests of the image lookups; a title or actor is found by the imdb id digits in
+    # its name, and its tmdb id is those digits. http/1.1 keeps connections alive like the real api does,
+    # otherwise every lookup would pay for a new connection and a new handler thread. headers and body are
+    # written separately, so nagle is off to not hold the body back for the client's delayed ack
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(tmdb_latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query).get('query', [''])[0]
+        digits = re.search(r'\d+', query)
+        tmdb_id = int(digits.group()) if digits else 0
+        path = url.path[len('/3'):]
+        if path in ('/search/movie', '/search/tv'):
+            body = {'total_results': 1, 'results': [{'id': tmdb_id}]}
+        elif path == '/search/person':
+            body = {'total_results': 1, 'results': [{'id': tmdb_id, 'name': query, 'profile_path': f'/a{tmdb_id}.jpg'}]}
+        elif path.endswith('/external_ids'):
+            body = {'imdb_id': f'tt{int(path.split("/")[2]):07d}'}
+        elif path.startswith('/person/'):
+            person_id = int(path.split('/')[2])
+            body = {'name': f'Actor {person_id}', 'imdb_id': f'nm{person_id:07d}', 'profile_path': f'/a{person_id}.jpg'}
+        else:
+            body = {'poster_path': f'/p{path.split("/")[2]}.jpg'}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def actor(name_id):
+    return {'actor': {'name_id': name_id, 'name': f'Actor {name_id}', 'movie_count': 1, 'episode_count': 0,
+                      'series_count': 0}}
+
+
+def movie(title_id):
+    return {'movie': {'title_id': title_id, 'title': f'Title {title_id}', 'year': 2000}}
+
+
+class StandInGraph:
+    # the ActorGraph calls the connection endpoint makes, answered after the graph latency with a two
+    # step connection through an actor and two titles derived from the pair
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def get_actor_connection(self, actor_id_1, actor_id_2, max_search_depth=20):
+        time.sleep(neo4j_latency)
+        number = int(actor_id_1[2:])
+        return [actor(actor_id_1), {'role': 'Self'}, movie(f'tt{number:07d}'), {'role': 'Self'},
+                actor(f'nm{number + 2:07d}'), {'role': 'Self'}, movie(f'tt{number + 1:07d}'), {'role': 'Self'},
+                actor(actor_id_2)]
+
+
+def stand_in_config():
+    # set before the apps read their config, with nothing shared between runs
+    os.environ['TMDB_BASE_URI'] = f'http://127.0.0.1:{TMDB_PORT}'
+    os.environ['TMDB_API_KEY'] = 'stand-in'
+    os.environ['HUB_INDEX_DIR'] = ''
+    # the per request log lines would interleave with the results
+    os.environ['REQUEST_LOG'] = '0'
+    os.environ.pop('IMAGE_CACHE_PATH', None)
+    os.environ.pop('CONNECTION_CACHE_PATH', None)
+    if sqlite_caches:
+        cache_dir = tempfile.mkdtemp(prefix='load_test_')
+        os.environ['IMAGE_CACHE_PATH'] = os.path.join(cache_dir, 'images.sqlite')
+        os.environ['CONNECTION_CACHE_PATH'] = os.path.join(cache_dir, 'connections.sqlite')
+
+
+def serve_tmdb():
+    TMDBStandInServer(('127.0.0.1', TMDB_PORT), TMDBStandIn).serve_forever()
+
+
+def serve_flask():
+    stand_in_config()
+    import app
+    app.ActorGraph = StandInGraph
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    # threaded=False handles one request at a time, like a sync gunicorn worker
+    make_server('127.0.0.1', FLASK_PORT, app.app, threaded=False).serve_forever()
+
+
+def serve_async():
+    stand_in_config()
+    import async_app
+    async_app.ActorGraph = StandInGraph
+    uvicorn.Server(uvicorn.Config(async_app.app, host='127.0.0.1', port=ASYNC_PORT, log_level='warning')).run()
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+async def run_load(port, first_number, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(client, i):
+        nonlocal failures
+        # ids four apart so no two requests share an actor or title
+        number = first_number + i * 4
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(f'http://127.0.0.1:{port}/actor/connection/nm{number:07d}/nm{number + 3:07d}/10')
+            latencies.append(time.perf_counter() - start)
+            # a tmdb lookup that timed out leaves its image out rather than failing the response
+            if response.status_code != 200 or response.json()['steps'] != 2 or \
+                    any(item['img_url'] is None for item in response.json()['connection'] if item['type'] != 'role'):
+                failures += 1
+
+    async with httpx.AsyncClient(timeout=None, limits=httpx.Limits(max_connections=concurrency)) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(request_count)))
+        elapsed = time.perf_counter() - start
+    return elapsed, sorted(latencies), failures
+
+
+if __name__ == '__main__':
+    # the stand-ins and each app run in their own process, so the load generator and the other
+    # servers do not compete with the server under test for the interpreter lock
+    servers = [multiprocessing.Process(target=serve, daemon=True) for serve in (serve_tmdb, serve_flask, serve_async)]
+    for server in servers:
+        server.start()
+    for port in (TMDB_PORT, FLASK_PORT, ASYNC_PORT):
+        wait_for_port(port)
+
+    print(f'{request_count} requests per run, tmdb latency {tmdb_latency * 1000:.0f} ms, '
+          f'graph latency {neo4j_latency * 1000:.0f} ms, sqlite caches {"on" if sqlite_caches else "off"}')
+    print(f"{'server':<8} {'concurrency':>11} {'seconds':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'failed':>6}")
+    first_number = 1000000
+    for concurrency in concurrency_levels:
+        for name, port in (('flask', FLASK_PORT), ('async', ASYNC_PORT)):
+            elapsed, latencies, failures = asyncio.run(run_load(port, first_number, concurrency))
+            first_number += request_count * 4
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f'{name:<8} {concurrency:>11} {elapsed:>8.2f} {request_count / elapsed:>8.1f} '
+                  f'{statistics.median(latencies) * 1000:>8.0f} {p95 * 1000:>8.0f} {failures:>6}')
@@ -0,0 +1,246 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import json
+import time
+import os
+
+# request instrumentation shared by app.py and async_app.py: the timings of the current request are kept
+# in a context variable (copied into the threads and tasks that work for it), stage timings and counts are
+# also observed into process wide histograms and counters served as prometheus text by /metrics
+REQUEST_LOG = os.getenv('REQUEST_LOG', '1').lower() in ('1', 'true', 'yes')
+# 'on' runs every query of a request with PROFILE and adds up its db hits, 'request' only for requests
+# with ?profile=1; PROFILE makes every query do extra work, so it is off by default
+NEO4J_PROFILE = os.getenv('NEO4J_PROFILE', 'off').lower()
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_current = ContextVar('request_timings', default=None)
+# the stage the current code runs in, see stage()
+_open_stage = ContextVar('open_stage', default=None)
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self.__lock:
+            self.__values[label_values] = self.__values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.__lock:
+            for label_values, value in sorted(self.__values.items()):
+                lines.append(f'{self.name}{_label_text(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> (count per bucket, sum, count)
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.__lock:
+            counts, total, count = self.__values.get(label_values, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.__values[label_values] = (counts, total + value, count + 1)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.__lock:
+            for label_values, (counts, total, count) in sorted(self.__values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _label_text(self.labels + ('le',), label_values + (bound,))
+                    lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+                labels = _label_text(self.labels + ('le',), label_values + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _label_text(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('actorconnector_request_seconds', 'Request latency', labels=('endpoint', 'status'))
+STAGE_SECONDS = Histogram('actorconnector_stage_seconds', 'Time spent in each request stage', labels=('stage',))
+TMDB_CALL_SECONDS = Histogram('actorconnector_tmdb_call_seconds', 'Latency of single tmdb api calls')
+EVENTS = Counter('actorconnector_events_total', 'Neo4j queries and db hits, tmdb calls and connection cache hits', labels=('event',))
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, TMDB_CALL_SECONDS, EVENTS]
+
+
+def render_metrics():
+    return '\n'.join(line for metric in REGISTRY for line in metric.expose()) + '\n'
+
+
+class RequestTimings:
+    def __init__(self, profile=False):
+        self.profile = profile
+        self.start = time.perf_counter()
+        # stage -> seconds, event -> count, both in the order first seen
+        self.stages = {}
+        self.counts = {}
+        self.__lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self.__lock:
+            self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def count(self, name, amount=1):
+        with self.__lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+
+def current():
+    return _current.get()
+
+
+def profiling():
+    timings = _current.get()
+    return timings is not None and timings.profile
+
+
+def start_request(profile_param=None):
+    profile = NEO4J_PROFILE == 'on' or (NEO4J_PROFILE == 'request' and profile_param in ('1', 'true', 'yes'))
+    timings = RequestTimings(profile)
+    _current.set(timings)
+    return timings
+
+
+def end_request():
+    _current.set(None)
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, name)
+    timings = _current.get()
+    if timings is not None:
+        timings.add_stage(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    # a stage opened inside another one is part of the outer stage and not timed again, so the stages of a
+    # request do not overlap and add up to no more than its total; a neo4j session opened while resolving
+    # a path is counted in path_search, not in neo4j as well
+    if _open_stage.get() is not None:
+        yield
+        return
+    token = _open_stage.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _open_stage.reset(token)
+        record_stage(name, time.perf_counter() - start)
+
+
+def tmdb_call(seconds):
+    TMDB_CALL_SECONDS.observe(seconds)
+    count('tmdb_calls')
+
+
+def count(name, amount=1):
+    EVENTS.inc(amount, name)
+    timings = _current.get()
+    if timings is not None:
+        timings.count(name, amount)
+
+
+def _record_request(timings, method, path, endpoint, status):
+    seconds = time.perf_counter() - timings.start
+    REQUEST_SECONDS.observe(seconds, endpoint, status)
+    if REQUEST_LOG:
+        print(json.dumps({'method': method, 'path': path, 'endpoint': endpoint, 'status': status,
+                          'ms': round(seconds * 1000, 1),
+                          'stages': {name: round(s * 1000, 1) for name, s in timings.stages.items()},
+                          **timings.counts}), flush=True)
+
+
+def _server_timing(timings):
+    entries = [f'{name};dur={s * 1000:.1f}' for name, s in timings.stages.items()]
+    entries += [f'{name.replace("_", "-")};desc="{value}"' for name, value in timings.counts.items()]
+    entries.append(f'total;dur={(time.perf_counter() - timings.start) * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def finish_request(timings, method, path, endpoint, status):
+    # records the request and returns its Server-Timing header value
+    _record_request(timings, method, path, endpoint, status)
+    return _server_timing(timings)
+
+
+def finish_streamed_request(timings, method, path, endpoint, status, body):
+    # returns (Server-Timing header value, body) for a response whose body is produced while it is sent.
+    # the header goes out first, so it only covers the time until then; the request is recorded when the
+    # first chunk of the body is ready, and the work behind every chunk is counted against the request
+    return _server_timing(timings), _first_byte_body(timings, body, lambda: _record_request(
+        timings, method, path, endpoint, status))
+
+
+def _first_byte_body(timings, body, record):
+    if hasattr(body, '__aiter__'):
+        return _async_first_byte_body(timings, body, record)
+    return _sync_first_byte_body(timings, body, record)
+
+
+def _sync_first_byte_body(timings, body, record):
+    iterator = iter(body)
+    recorded = False
+    try:
+        while True:
+            token = _current.set(timings)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                _current.reset(token)
+            if not recorded:
+                recorded = True
+                record()
+            yield chunk
+    finally:
+        if not recorded:
+            record()
+        if hasattr(body, 'close'):
+            body.close()
+
+
+async def _async_first_byte_body(timings, body, record):
+    iterator = body.__aiter__()
+    recorded = False
+    try:
+        while True:
+            token = _current.set(timings)
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                _current.reset(token)
+            if not recorded:
+                recorded = True
+                record()
+            yield chunk
+    finally:
+        if not recorded:
+            record()
+        if hasattr(body, 'aclose'):
+            await body.aclose()
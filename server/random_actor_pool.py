@@ -0,0 +1,66 @@
+from collections import deque
+import threading
+import time
+
+
+class RandomActorPool:
+    # keeps a few pre-validated random actors ready and refills them on a background thread, so a
+    # random actor request is served without waiting on the graph or tmdb
+    def __init__(self, fetch, size=20, retry_delay=5, max_misses=100, version=None):
+        self.fetch = fetch
+        self.version = version
+        self.size = size
+        self.retry_delay = retry_delay
+        self.max_misses = max_misses
+        self.__actors = deque()
+        self.__refill = threading.Event()
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def __start(self):
+        # started on first use rather than at import so every forked worker runs its own thread
+        with self.__lock:
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(target=self.__run, name='random-actor-pool', daemon=True)
+                self.__thread.start()
+
+    def __current_version(self):
+        return self.version() if self.version is not None else None
+
+    def __run(self):
+        while True:
+            self.__refill.wait()
+            self.__refill.clear()
+            misses = 0
+            while len(self.__actors) < self.size:
+                version = self.__current_version()
+                try:
+                    actor = self.fetch()
+                except Exception:
+                    # the graph or tmdb is down, back off before trying again
+                    time.sleep(self.retry_delay)
+                    continue
+                if actor is None:
+                    # an actor without a tmdb match is retried straight away, a graph that keeps returning
+                    # nothing waits for the next request instead of spinning
+                    misses += 1
+                    if misses >= self.max_misses:
+                        break
+                    continue
+                misses = 0
+                # tagged with the graph version it was read from, so an actor fetched across an update is dropped
+                self.__actors.append((version, actor))
+
+    def get(self):
+        self.__start()
+        self.__refill.set()
+        version = self.__current_version()
+        while True:
+            try:
+                actor_version, actor = self.__actors.popleft()
+            except IndexError:
+                return None
+            if actor_version == version:
+                return actor
+            # the graph changed since these actors were picked, they may have been deleted
+            self.__actors.clear()
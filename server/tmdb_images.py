@@ -0,0 +1,254 @@
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from cache import LRUCache, SQLiteCache, TieredCache, MISSING
+import metrics
+import requests
+import tmdbsimple as tmdb
+
+load_dotenv()
+TMDB_API_URI = 'https://api.themoviedb.org'
+TMDB_BASE_URI = os.getenv('TMDB_BASE_URI', TMDB_API_URI).rstrip('/')
+TMDB_MAX_CONCURRENCY = int(os.getenv('TMDB_MAX_CONCURRENCY', 8))
+TMDB_TIMEOUT = float(os.getenv('TMDB_TIMEOUT', 5))
+IMAGE_PREFIX = 'https://image.tmdb.org/t/p/w185'
+SMALL_IMAGE_PREFIX = 'https://image.tmdb.org/t/p/w45'
+IMAGE_CACHE_SIZE = int(os.getenv('IMAGE_CACHE_SIZE', 50000))
+IMAGE_CACHE_TTL = int(os.getenv('IMAGE_CACHE_TTL', 7 * 24 * 3600))
+IMAGE_CACHE_NEGATIVE_TTL = int(os.getenv('IMAGE_CACHE_NEGATIVE_TTL', 24 * 3600))
+IMAGE_CACHE_PATH = os.getenv('IMAGE_CACHE_PATH')
+
+
+class TMDBSession(requests.Session):
+    # keeps connections to TMDB alive across lookups and lets a local stand-in
+    # replace the real API by setting TMDB_BASE_URI
+    def __init__(self, base_uri, pool_size):
+        super().__init__()
+        self.base_uri = base_uri
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if self.base_uri != TMDB_API_URI and url.startswith(TMDB_API_URI):
+            url = self.base_uri + url[len(TMDB_API_URI):]
+        start = time.perf_counter()
+        try:
+            return super().request(method, url, *args, **kwargs)
+        finally:
+            metrics.tmdb_call(time.perf_counter() - start)
+
+
+tmdb.API_KEY = os.getenv('TMDB_API_KEY')
+tmdb.REQUESTS_SESSION = TMDBSession(TMDB_BASE_URI, TMDB_MAX_CONCURRENCY)
+tmdb.REQUESTS_TIMEOUT = TMDB_TIMEOUT
+
+# tmdb lookups keyed by imdb id ('poster:<title_id>', 'profile:<name_id>', 'tmdb_id:<name_id>') and by
+# tmdb person id ('person:<tmdb_id>'); images are stored as tmdb paths so any size prefix can be applied,
+# and '' records that tmdb has no image so misses are not looked up again until the shorter negative ttl
+image_cache = TieredCache(LRUCache(IMAGE_CACHE_SIZE, IMAGE_CACHE_TTL),
+                          SQLiteCache(IMAGE_CACHE_PATH, IMAGE_CACHE_TTL) if IMAGE_CACHE_PATH else None)
+
+_executor = ThreadPoolExecutor(max_workers=TMDB_MAX_CONCURRENCY, thread_name_prefix='tmdb')
+# when the response that started a lookup stops waiting for it; a running future cannot be cancelled,
+# so the lookup itself gives up at that point instead of holding an executor thread nobody reads from
+_deadline = contextvars.ContextVar('tmdb_deadline', default=None)
+
+
+def _cache_path(key, path):
+    if path:
+        image_cache.set(key, path)
+    else:
+        image_cache.set(key, '', ttl=IMAGE_CACHE_NEGATIVE_TTL)
+
+
+def _image_url(path, prefix=IMAGE_PREFIX):
+    return prefix + path if path else None
+
+
+# the lookups are written once, as generators that yield the tmdb api requests they need as (path, params)
+# and are sent back the decoded json responses; _run drives them over the requests session above and
+# tmdb_images_async over an async http client, reading and writing image_cache the same way
+
+def advance(steps, response=None):
+    # sends a response into a lookup, returns (True, its result) once it is done and (False, the next
+    # request) otherwise
+    try:
+        return False, steps.send(response)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def _tmdb_get(path, params):
+    timeout = TMDB_TIMEOUT
+    deadline = _deadline.get()
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise TimeoutError(f'tmdb lookup abandoned before {path}')
+    response = tmdb.REQUESTS_SESSION.get(f'{TMDB_API_URI}/3/{path}', params=dict(params, api_key=tmdb.API_KEY),
+                                         timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def _run(steps):
+    done, request = advance(steps)
+    while not done:
+        done, request = advance(steps, _tmdb_get(*request))
+    return request
+
+
+def _poster_path_steps(title, imdb_id, prod_type):
+    kind = 'movie' if prod_type == 'movie' else 'tv'
+    results = yield f'search/{kind}', {'query': title}
+    if results['total_results'] == 0:
+        return None
+    for r in results['results']:
+        cur_res = yield f'{kind}/{r["id"]}/external_ids', {}
+        if 'imdb_id' in cur_res and cur_res['imdb_id'] == imdb_id:
+            prod = yield f'{kind}/{r["id"]}', {}
+            if 'poster_path' not in prod or prod['poster_path'] is None or prod['poster_path'] == '':
+                return None
+            return prod['poster_path']
+    return None
+
+
+def _profile_path_steps(actor_name, imdb_id):
+    results = yield 'search/person', {'query': actor_name}
+    if results['total_results'] == 0:
+        return None
+    elif results['total_results'] == 1:
+        single_res = results['results'][0]
+        if 'profile_path' not in single_res or single_res['profile_path'] is None or single_res['profile_path'] == '':
+            return None
+        return single_res['profile_path']
+    else:
+        for r in results['results']:
+            actor = yield from person_steps(r['id'])
+            if actor['imdb_id'] == imdb_id:
+                image_cache.set(f'tmdb_id:{imdb_id}', r['id'])
+                return actor['profile_path']
+        # if imdb_ids don't match we just return the first profile pic we find from the name, it is usually correct
+        for r in results['results']:
+            if 'profile_path' in r and r['profile_path'] != '' and r['profile_path'] is not None:
+                return r['profile_path']
+    return None
+
+
+def _cached_path_steps(key, find_steps):
+    path = image_cache.get(key)
+    if path is MISSING:
+        path = yield from find_steps
+        _cache_path(key, path)
+    return path or None
+
+
+def person_steps(tmdb_id):
+    key = f'person:{tmdb_id}'
+    person = image_cache.get(key)
+    if person is MISSING:
+        info = yield f'person/{tmdb_id}', {}
+        person = {'tmdb_id': tmdb_id,
+                  'name': info.get('name'),
+                  'imdb_id': info.get('imdb_id') or None,
+                  'profile_path': info.get('profile_path') or None}
+        image_cache.set(key, person)
+        if person['imdb_id']:
+            image_cache.set(f'tmdb_id:{person["imdb_id"]}', tmdb_id)
+            _cache_path(f'profile:{person["imdb_id"]}', person['profile_path'])
+    return person
+
+
+def _tmdb_id_steps(actor_name, imdb_id):
+    key = f'tmdb_id:{imdb_id}'
+    tmdb_id = image_cache.get(key)
+    if tmdb_id is not MISSING:
+        return tmdb_id
+    tmdb_id = None
+    results = yield 'search/person', {'query': actor_name}
+    for r in results['results']:
+        if (yield from person_steps(r['id']))['imdb_id'] == imdb_id:
+            tmdb_id = r['id']
+            break
+    image_cache.set(key, tmdb_id, ttl=None if tmdb_id else IMAGE_CACHE_NEGATIVE_TTL)
+    return tmdb_id
+
+
+def image_steps(lookup):
+    # the image url of a ('poster', title, imdb_id, prod_type) or ('profile', name, imdb_id) lookup
+    if lookup[0] == 'profile':
+        path = yield from _cached_path_steps(f'profile:{lookup[2]}', _profile_path_steps(lookup[1], lookup[2]))
+    else:
+        path = yield from _cached_path_steps(f'poster:{lookup[2]}', _poster_path_steps(lookup[1], lookup[2], lookup[3]))
+    return _image_url(path)
+
+
+def get_poster_path(title, imdb_id, prod_type):
+    return _run(_cached_path_steps(f'poster:{imdb_id}', _poster_path_steps(title, imdb_id, prod_type)))
+
+
+def get_profile_path(actor_name, imdb_id):
+    return _run(_cached_path_steps(f'profile:{imdb_id}', _profile_path_steps(actor_name, imdb_id)))
+
+
+def get_poster(title, imdb_id, prod_type):
+    return _image_url(get_poster_path(title, imdb_id, prod_type))
+
+
+def get_profile_pic(actor_name, imdb_id):
+    return _image_url(get_profile_path(actor_name, imdb_id))
+
+
+def get_person(tmdb_id):
+    return _run(person_steps(tmdb_id))
+
+
+# tmdb person id for an imdb name id, searching tmdb by name when it is not already known
+def find_tmdb_id(actor_name, imdb_id):
+    return _run(_tmdb_id_steps(actor_name, imdb_id))
+
+
+def _lookup(lookup):
+    return _run(image_steps(lookup))
+
+
+def _call_before(deadline, func, arg):
+    _deadline.set(deadline)
+    return func(arg)
+
+
+# runs func over args concurrently and returns one result per args, in order; identical args are only
+# run once, and a call that fails or is not finished within the timeout results in None rather than
+# failing the whole response. calls still queued at the timeout are cancelled and running ones stop at
+# their next tmdb request, each request's timeout being cut to what is left of the budget
+def _map_concurrently(func, args, timeout=None):
+    timeout = TMDB_TIMEOUT * 2 if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    futures = {}
+    for arg in args:
+        if arg not in futures:
+            # in the request's context, so its lookups are counted against it
+            futures[arg] = _executor.submit(contextvars.copy_context().run, _call_before, deadline, func, arg)
+    done, not_done = wait(futures.values(), timeout=timeout)
+    for future in not_done:
+        future.cancel()
+    results = {}
+    for arg, future in futures.items():
+        if future in done and future.exception() is None:
+            results[arg] = future.result()
+        else:
+            results[arg] = None
+    return [results[arg] for arg in args]
+
+
+# resolves ('poster', title, imdb_id, prod_type) and ('profile', name, imdb_id) lookups to image urls
+def get_images(lookups, timeout=None):
+    return _map_concurrently(_lookup, lookups, timeout)
+
+
+def get_people(tmdb_ids, timeout=None):
+    return _map_concurrently(get_person, tmdb_ids, timeout)
@@ -0,0 +1,98 @@
+import os
+import time
+import asyncio
+import metrics
+from tmdb_images import image_cache, advance, image_steps, person_steps, TMDB_BASE_URI, TMDB_TIMEOUT
+import httpx
+import tmdbsimple as tmdb
+
+# the tmdb_images lookups for the async app: the same lookup generators, with their tmdb requests sent
+# over one pooled httpx client per event loop instead of blocking a thread each. they share the image
+# cache with the sync lookups, so a path found by either is reused by both
+TMDB_ASYNC_MAX_CONNECTIONS = int(os.getenv('TMDB_ASYNC_MAX_CONNECTIONS', 64))
+
+_clients = {}
+
+
+def _client():
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        _clients[loop] = httpx.AsyncClient(
+            base_url=f'{TMDB_BASE_URI}/3/', timeout=TMDB_TIMEOUT,
+            limits=httpx.Limits(max_connections=TMDB_ASYNC_MAX_CONNECTIONS,
+                                max_keepalive_connections=TMDB_ASYNC_MAX_CONNECTIONS))
+    return _clients[loop]
+
+
+async def close_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _get(path, **params):
+    start = time.perf_counter()
+    try:
+        response = await _client().get(path, params=dict(params, api_key=tmdb.API_KEY))
+    finally:
+        metrics.tmdb_call(time.perf_counter() - start)
+    response.raise_for_status()
+    return response.json()
+
+
+async def search_people(query):
+    return await _get('search/person', query=query)
+
+
+async def _run(steps):
+    # the async tmdb_images._run: the lookup's steps read and write image_cache, which blocks on sqlite
+    # when it has a shared tier, so they then run on the default thread pool between requests
+    loop = asyncio.get_running_loop()
+    response = None
+    while True:
+        if image_cache.shared is None:
+            done, request = advance(steps, response)
+        else:
+            done, request = await loop.run_in_executor(None, advance, steps, response)
+        if done:
+            return request
+        path, params = request
+        response = await _get(path, **params)
+
+
+async def get_person(tmdb_id):
+    return await _run(person_steps(tmdb_id))
+
+
+async def _lookup(lookup):
+    return await _run(image_steps(lookup))
+
+
+# the async counterpart of tmdb_images._map_concurrently: identical args run once, and a call that fails
+# or is not finished within the timeout results in None
+async def _map_concurrently(func, args, timeout=None):
+    timeout = TMDB_TIMEOUT * 2 if timeout is None else timeout
+    tasks = {}
+    for arg in args:
+        if arg not in tasks:
+            tasks[arg] = asyncio.ensure_future(func(arg))
+    if not tasks:
+        return []
+    done, not_done = await asyncio.wait(tasks.values(), timeout=timeout)
+    for task in not_done:
+        task.cancel()
+    results = {}
+    for arg, task in tasks.items():
+        if task in done and task.exception() is None:
+            results[arg] = task.result()
+        else:
+            results[arg] = None
+    return [results[arg] for arg in args]
+
+
+async def get_images(lookups, timeout=None):
+    return await _map_concurrently(_lookup, lookups, timeout)
+
+
+async def get_people(tmdb_ids, timeout=None):
+    return await _map_concurrently(get_person, tmdb_ids, timeout)
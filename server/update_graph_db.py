@@ -0,0 +1,80 @@
+from actor_graph import ActorGraph, mark_graph_changed
+from batch_delta import batch_changes
+from dotenv import load_dotenv
+from itertools import chain
+import os
+
+# applies the difference between the previous and the current batch files to a loaded graph instead
+# of rebuilding it; create_batch_files.py keeps the previous conversion in batch_files_prev
+
+load_dotenv()
+db_user = os.getenv('NEO4J_USER')
+db_pass = os.getenv('NEO4J_PASS')
+batch_dir = 'batch_files'
+previous_batch_dir = 'batch_files_prev'
+
+if not os.path.isdir(previous_batch_dir):
+    raise SystemExit(f'no previous batch files in {previous_batch_dir}, run a full load instead')
+
+
+def upserts(filename):
+    return batch_changes(previous_batch_dir, batch_dir, filename, 'upsert')
+
+
+def deletes(filename):
+    return batch_changes(previous_batch_dir, batch_dir, filename, 'delete')
+
+
+def ids(rows, column):
+    return (r[column] for r in rows)
+
+
+# the rows stream from the merge into the chunked writes, only the ids the update has to look up
+# before it removes anything are collected
+print('computing removed ids ...')
+removed_title_ids = set(ids(chain(deletes('movie_batch.tsv'), deletes('episode_batch.tsv')), 'title_id'))
+# a title that moved between the movie and episode files is relabelled by its upsert, so only ids
+# missing from both current files are removed
+relabelled_ids = {title_id for title_id in ids(chain(upserts('movie_batch.tsv'), upserts('episode_batch.tsv')), 'title_id')
+                  if title_id in removed_title_ids}
+removed_production_ids = removed_title_ids - relabelled_ids
+removed_series_ids = set(ids(deletes('series_batch.tsv'), 'title_id'))
+relinked_episode_ids = set(ids(chain(upserts('episode_relation_batch.tsv'), deletes('episode_relation_batch.tsv')), 'episode_id'))
+print(f'  {len(removed_production_ids)} productions and {len(removed_series_ids)} series removed, '
+      f'{len(relabelled_ids)} relabelled, {len(relinked_episode_ids)} episodes relinked')
+
+with ActorGraph(db_user, db_pass) as graph:
+    print('db update start')
+    # a relabelled title moves its actors' roles between their movie and episode counts
+    affected_actor_ids = set(graph.get_actor_ids_of_titles(
+        removed_production_ids | removed_series_ids | relinked_episode_ids | relabelled_ids))
+    affected_actor_ids.update(ids(chain(upserts('actor_relation_batch.tsv'), deletes('actor_relation_batch.tsv')), 'name_id'))
+    print('updating nodes ...')
+    actor_count = graph.add_actors(upserts('actor_batch.tsv'))
+    movie_count = graph.add_movies(upserts('movie_batch.tsv'))
+    series_count = graph.add_series_list(upserts('series_batch.tsv'))
+    episode_count = graph.add_episodes(upserts('episode_batch.tsv'))
+    print(f'  {actor_count} actors, {movie_count} movies, {series_count} series, {episode_count} episodes added or changed')
+    print('updating relations ...')
+    role_count = graph.add_roles(upserts('actor_relation_batch.tsv'))
+    removed_role_count = graph.delete_roles(deletes('actor_relation_batch.tsv'))
+    graph.disconnect_episodes(ids(deletes('episode_relation_batch.tsv'), 'episode_id'))
+    graph.connect_episodes(upserts('episode_relation_batch.tsv'))
+    print(f'  {role_count} roles added or changed, {removed_role_count} removed')
+    print('removing nodes ...')
+    graph.delete_productions(removed_production_ids)
+    graph.delete_series(removed_series_ids)
+    removed_actor_ids = set(ids(deletes('actor_batch.tsv'), 'name_id'))
+    graph.delete_actors(removed_actor_ids)
+    print(f'  {len(removed_actor_ids)} actors removed')
+    print('refreshing actor statistics ...')
+    graph.refresh_actor_stats(affected_actor_ids - removed_actor_ids)
+    if actor_count or removed_actor_ids or role_count or removed_role_count or removed_production_ids:
+        print('indexing random actors ...')
+        graph.index_random_actors()
+    print('storing graph totals ...')
+    graph.store_graph_totals()
+    print('db update end')
+    mark_graph_changed()
+
+print('graph database update complete')